@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+'''
+Checkpoint and resume long runs. Every `every` genes, after the output of a
+whole gene has been written, the checkpoint file is replaced by a small JSON
+record of:
+
+ * gene - identifier of the last fully written gene
+ * gff_offset - byte offset in the GFF just past that gene
+ * output_offset - size of the output at that point
+ * run - the GFF path, size and modification time, and a digest of the
+   other options of the run (see describe_run)
+
+On resume, the GFF is opened at gff_offset and the output is truncated to
+output_offset, dropping any partial output written after the checkpoint. A
+checkpoint is only resumed by the run that wrote it: if the run differs or the
+output is missing or shorter than output_offset, resuming exits with an error.
+'''
+
+import hashlib
+import json
+import os
+import sys
+
+class OffsetReader:
+    '''
+    Iterate over the decoded lines of a binary file. line_offset is the byte
+    offset of the line most recently yielded and offset is the offset of the
+    next line to be read.
+    '''
+    def __init__(self, handle, encoding='utf-8'):
+        self.handle = handle
+        self.encoding = encoding
+        self.offset = handle.tell()
+        self.line_offset = self.offset
+
+    def __iter__(self):
+        for line in self.handle:
+            self.line_offset = self.offset
+            self.offset += len(line)
+            yield line.decode(self.encoding)
+
+    def close(self):
+        self.handle.close()
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return(h.hexdigest())
+
+def describe_run(gffpath, options):
+    '''
+    Identify a run by its GFF path, size and modification time, and by a
+    digest of options, a JSON-serializable record of everything else that
+    affects the output
+    '''
+    stat = os.stat(gffpath)
+    digest = hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()
+    return({
+        'gff': os.path.abspath(gffpath),
+        'gff_size': stat.st_size,
+        'gff_mtime': stat.st_mtime_ns,
+        'options': digest
+    })
+
+class Checkpoint:
+    def __init__(self, path, every=1000, run=None):
+        self.path = path
+        self.every = every
+        self.run = run
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return(json.load(f))
+        except FileNotFoundError:
+            return(None)
+        except ValueError:
+            sys.exit("Checkpoint file '%s' is corrupt" % self.path)
+
+    def open(self, gffpath, outpath, resume=False):
+        '''
+        Return (gff, out): an OffsetReader over the GFF and the output handle,
+        both positioned just past the last checkpointed gene if resuming
+        '''
+        state = self.load() if resume else None
+        if state:
+            self.check(state, outpath)
+        gff = open(gffpath, 'rb')
+        if state:
+            gff.seek(state['gff_offset'])
+            with open(outpath, 'r+b') as f:
+                f.truncate(state['output_offset'])
+            out = open(outpath, 'a')
+        else:
+            out = open(outpath, 'w')
+        return(OffsetReader(gff), out)
+
+    def check(self, state, outpath):
+        if state.get('run') != self.run:
+            sys.exit("Checkpoint '%s' was written by a different run (GFF or "
+                     "options changed), cannot resume" % self.path)
+        if not os.path.exists(outpath):
+            sys.exit("Cannot resume from checkpoint '%s': output '%s' is "
+                     "missing" % (self.path, outpath))
+        if os.path.getsize(outpath) < state['output_offset']:
+            sys.exit("Cannot resume from checkpoint '%s': output '%s' is "
+                     "shorter than when checkpointed" % (self.path, outpath))
+
+    def save(self, gene, out):
+        out.flush()
+        os.fsync(out.fileno())
+        state = {
+            'gene': gene.ident,
+            'gff_offset': gene.end,
+            'output_offset': out.tell(),
+            'run': self.run
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+def write_checkpointed(blocks, out, checkpoint):
+    '''
+    Write the lines of each (gene, lines) block to out, saving a checkpoint
+    after every checkpoint.every genes and after the last gene
+    '''
+    gene = None
+    for i, (gene, lines) in enumerate(blocks, 1):
+        for line in lines:
+            print(line, file=out)
+        if i % checkpoint.every == 0:
+            checkpoint.save(gene, out)
+    if gene:
+        checkpoint.save(gene, out)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+'''
+Column-oriented batches of phaser results. Each batch holds one typed array
+per column. Identifier columns are dictionary-encoded: the array holds integer
+codes into a list of distinct values. The dictionaries are shared by all
+batches of a run and only ever grow, so a code means the same thing in every
+batch.
+
+Columns use the array typecode 'l' (C long), whose size is platform
+dependent: 8 bytes on 64-bit Linux and macOS, but 4 bytes on Windows.
+Consumers reading a column's buffer directly, e.g. with numpy.frombuffer,
+must use a matching dtype (numpy.dtype('l') or columns[name].itemsize).
+'''
+
+from array import array
+
+class Dictionary:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        try:
+            return(self.codes[value])
+        except KeyError:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+            return(self.codes[value])
+
+class Batch:
+    def __init__(self, names, encoded, dictionaries):
+        self.names = names
+        self.dictionaries = dictionaries
+        self.columns = {name: array('l') for name in names}
+        self._encoders = [dictionaries[name].encode if name in encoded else None
+                          for name in names]
+        self._appenders = [self.columns[name].append for name in names]
+
+    def __len__(self):
+        return(len(self.columns[self.names[0]]))
+
+    def append(self, row):
+        for encode, append, value in zip(self._encoders, self._appenders, row):
+            append(encode(value) if encode else value)
+
+    def decode(self, name):
+        '''
+        Return the values of a column, replacing codes with their values
+        '''
+        if name in self.dictionaries:
+            values = self.dictionaries[name].values
+            return([values[i] for i in self.columns[name]])
+        return(list(self.columns[name]))
+
+    def rows(self):
+        return(list(zip(*(self.decode(name) for name in self.names))))
+
+def batches(rows, names, encoded, size=65536):
+    '''
+    Collect rows (tuples ordered as names) into Batches of at most size rows,
+    dictionary-encoding the columns named in encoded
+    '''
+    dictionaries = {name: Dictionary() for name in encoded}
+    batch = Batch(names, encoded, dictionaries)
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = Batch(names, encoded, dictionaries)
+    if len(batch):
+        yield batch
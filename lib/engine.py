@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+'''
+Run work over batches of a shared, read-only list on a pool of threads. Each
+batch is handled by one thread, which returns its own buffer of results, and
+the buffers are yielded in the order of the batches, so the output does not
+depend on the number of threads.
+
+On free-threaded (no-GIL) builds of CPython the threads run in parallel. On
+standard builds they would only contend for the GIL, so usable_threads
+reduces any request to a single thread there.
+'''
+
+import collections
+import concurrent.futures
+import sys
+
+def gil_enabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return(is_gil_enabled() if is_gil_enabled else True)
+
+def usable_threads(requested):
+    return(1 if gil_enabled() else max(1, requested))
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+def run_batches(work, items, threads, batchsize=256):
+    '''
+    Yield work(batch) for consecutive batches of items, in order. At most
+    2 * threads batches are in flight at once.
+    '''
+    batches = chunks(items, batchsize)
+    if threads <= 1:
+        for batch in batches:
+            yield work(batch)
+        return
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.submit(work, batch))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
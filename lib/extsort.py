@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+'''
+Sort records by genomic coordinate (seqid, then start, then stop) in bounded
+memory. Records are collected in memory until a ceiling is reached, then the
+sorted run is written to a temporary file as packed binary records. The runs
+are combined with a k-way merge.
+
+Ties keep their input order, so sorting already sorted input is a no-op.
+
+Sorted output can be given a block index, one line per block of at most
+`blocksize` records from a single seqid, with TAB-delimited columns:
+
+ 1. seqid
+ 2. smallest start in the block
+ 3. largest stop in the block
+ 4. byte offset of the block's first line
+ 5. number of lines in the block
+
+`query` uses this index to read only the blocks that may overlap a region.
+'''
+
+import heapq
+import struct
+import tempfile
+
+# start, stop, serial, seqid length, payload length
+HEADER = struct.Struct('<IIQHI')
+
+# Rough per-record cost of the in-memory tuple, beyond the string lengths
+RECORD_OVERHEAD = 150
+
+class ExternalSorter:
+    def __init__(self, memory=512*2**20, tmpdir=None):
+        self.memory = memory
+        self.tmpdir = tmpdir
+        self.records = []
+        self.used = 0
+        self.serial = 0
+        self.runs = []
+
+    def add(self, seqid, start, stop, payload):
+        self.records.append((seqid, start, stop, self.serial, payload))
+        self.serial += 1
+        self.used += len(seqid) + len(payload) + RECORD_OVERHEAD
+        if self.used >= self.memory:
+            self._spill()
+
+    def _spill(self):
+        self.records.sort()
+        run = tempfile.TemporaryFile(dir=self.tmpdir)
+        for seqid, start, stop, serial, payload in self.records:
+            seqid, payload = seqid.encode(), payload.encode()
+            run.write(HEADER.pack(start, stop, serial, len(seqid), len(payload)))
+            run.write(seqid)
+            run.write(payload)
+        run.seek(0)
+        self.runs.append(run)
+        self.records = []
+        self.used = 0
+
+    @staticmethod
+    def _read_run(run):
+        while True:
+            header = run.read(HEADER.size)
+            if not header:
+                break
+            start, stop, serial, nseqid, npayload = HEADER.unpack(header)
+            seqid = run.read(nseqid).decode()
+            payload = run.read(npayload).decode()
+            yield (seqid, start, stop, serial, payload)
+
+    def __iter__(self):
+        '''
+        Yield (seqid, start, stop, payload) in sorted order
+        '''
+        self.records.sort()
+        runs = [self._read_run(run) for run in self.runs] + [iter(self.records)]
+        for seqid, start, stop, serial, payload in heapq.merge(*runs):
+            yield (seqid, start, stop, payload)
+        self.cleanup()
+
+    def cleanup(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.records = []
+
+def write_sorted(records, out, indexout=None, blocksize=1024):
+    '''
+    Write (seqid, start, stop, payload) records as "seqid start stop payload"
+    lines, and optionally a block index of the written lines to indexout
+    '''
+    offset = 0
+    block = None
+    for seqid, start, stop, payload in records:
+        line = '%s %d %d %s\n' % (seqid, start, stop, payload)
+        out.write(line)
+        if indexout:
+            if block and (block[0] != seqid or block[4] >= blocksize):
+                print('\t'.join(str(x) for x in block), file=indexout)
+                block = None
+            if not block:
+                block = [seqid, start, stop, offset, 0]
+            block[2] = max(block[2], stop)
+            block[4] += 1
+            offset += len(line.encode())
+    if block:
+        print('\t'.join(str(x) for x in block), file=indexout)
+
+def read_index(indexfile):
+    index = []
+    with open(indexfile) as f:
+        for line in f:
+            seqid, start, stop, offset, count = line.rstrip('\n').split('\t')
+            index.append((seqid, int(start), int(stop), int(offset), int(count)))
+    return(index)
+
+def query(sortedfile, indexfile, seqid, start, stop):
+    '''
+    Yield the lines of a sorted file whose interval overlaps (start, stop)
+    on seqid, reading only the blocks that may hold them
+    '''
+    with open(sortedfile, 'rb') as f:
+        for bseqid, bstart, bstop, offset, count in read_index(indexfile):
+            if bseqid != seqid or bstart > stop or bstop < start:
+                continue
+            f.seek(offset)
+            for _ in range(count):
+                line = f.readline().decode().rstrip('\n')
+                a, b = (int(x) for x in line.split(' ', 3)[1:3])
+                if a <= stop and b >= start:
+                    yield line
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+'''
+Random access to a genome FASTA through a faidx-style index. The index has one
+line per sequence with five TAB-delimited columns:
+
+ 1. sequence name
+ 2. sequence length
+ 3. byte offset of the first base
+ 4. bases per line
+ 5. bytes per line (including the newline)
+
+If the index does not exist it is built in a single pass over the FASTA. The
+FASTA itself is memory-mapped, so extracting an interval only touches the
+pages that hold it.
+'''
+
+import mmap
+import os
+import sys
+
+COMPLEMENT = str.maketrans('ACGTUMRWSYKVHDBNacgtumrwsykvhdbn',
+                           'TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn')
+
+CODONS = {}
+_bases = 'TCAG'
+_aminos = 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+for i, aa in enumerate(_aminos):
+    CODONS[_bases[i // 16] + _bases[(i // 4) % 4] + _bases[i % 4]] = aa
+
+def revcomp(seq):
+    return(seq.translate(COMPLEMENT)[::-1])
+
+def translate(seq):
+    seq = seq.upper().replace('U', 'T')
+    return(''.join(CODONS.get(seq[i:i+3], 'X') for i in range(0, len(seq) - 2, 3)))
+
+def write_fasta(header, seq, out=None, width=60):
+    # sys.stdout is looked up on each call, so that a redirected stdout is used
+    out = out if out else sys.stdout
+    print('>' + header, file=out)
+    for i in range(0, len(seq), width):
+        print(seq[i:i+width], file=out)
+
+def build_fai(fastafile, indexfile):
+    '''
+    Write a faidx-style index for fastafile. All lines of a sequence, except
+    the last, must have the same length.
+    '''
+    entries = []
+    name = None
+    offset = 0
+    with open(fastafile, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    entries.append((name, length, start, linebases, linewidth))
+                name = line[1:].split()[0].decode()
+                length, start, linebases, linewidth = 0, offset + len(line), 0, 0
+                short = False
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if short and bases:
+                    sys.exit("FASTA sequence '%s' has uneven line lengths, cannot index" % name)
+                if not linebases:
+                    linebases, linewidth = bases, len(line)
+                elif bases > linebases:
+                    sys.exit("FASTA sequence '%s' has uneven line lengths, cannot index" % name)
+                short = bases < linebases
+                length += bases
+            offset += len(line)
+    if name is not None:
+        entries.append((name, length, start, linebases, linewidth))
+    with open(indexfile, 'w') as f:
+        for entry in entries:
+            print('\t'.join(str(e) for e in entry), file=f)
+
+def read_fai(indexfile):
+    index = {}
+    with open(indexfile) as f:
+        for line in f:
+            row = line.split('\t')
+            try:
+                index[row[0]] = tuple(int(x) for x in row[1:5])
+            except (IndexError, ValueError):
+                sys.exit("FASTA index lines must have 5 columns (name, length, offset, linebases, linewidth)")
+    return(index)
+
+class IndexedFasta:
+    def __init__(self, fastafile, indexfile=None):
+        indexfile = indexfile if indexfile else fastafile + '.fai'
+        if not os.path.exists(indexfile):
+            build_fai(fastafile, indexfile)
+        self.index = read_fai(indexfile)
+        self._handle = open(fastafile, 'rb')
+        self._map = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _position(self, seqid, i):
+        length, offset, linebases, linewidth = self.index[seqid]
+        return(offset + (i // linebases) * linewidth + i % linebases)
+
+    def fetch(self, seqid, start, stop, strand="+"):
+        '''
+        Return the bases from start to stop (1-based, inclusive) of seqid,
+        reverse complemented if strand is "-"
+        '''
+        if seqid not in self.index:
+            sys.exit("Sequence '%s' is not in the genome FASTA" % seqid)
+        start, stop = sorted([start, stop])
+        if start < 1 or stop > self.index[seqid][0]:
+            sys.exit("Interval (%d, %d) is outside of sequence '%s'" % (start, stop, seqid))
+        raw = self._map[self._position(seqid, start - 1):self._position(seqid, stop - 1) + 1]
+        seq = raw.translate(None, b'\r\n').decode()
+        return(revcomp(seq) if strand == "-" else seq)
+
+    def close(self):
+        self._map.close()
+        self._handle.close()
@@ -5,8 +5,11 @@ Assumes gff3 files follow the phytozome/metazom convetions. Any deviance from
 this format should instantly kill the program. See README.
 '''
 
+import collections
+import os
 import re
 import sys
+import tempfile
 
 def a_is_downstream_of_b(a, b, strand):
     if strand == "+":
@@ -34,6 +37,12 @@ def parse_desc(desc):
     except AttributeError:
         return(None)
 
+def parse_parents(desc):
+    try:
+        return(re.search('(?:^|;)Parent=([^;]+)', desc).group(1).split(','))
+    except AttributeError:
+        return([])
+
 def line2gffdict(line):
     row = line.split('\t')
     if len(row) == 9:
@@ -46,10 +55,65 @@ def line2gffdict(line):
         out = None
     return out
 
-def gff_reader(gfffile, errout=sys.stderr):
+class GeneSelector:
+    '''
+    Pass through only the lines of genes that have at least one mRNA whose
+    identifier is in wanted. All other genes are dropped after reading only
+    the type column of each line (and the ID of each mRNA).
+
+    If gfffile tracks byte offsets (see checkpoint.OffsetReader), so does the
+    selector: line_offset is the offset of the line most recently yielded.
+    '''
+    def __init__(self, gfffile, wanted):
+        self.gfffile = gfffile
+        self.wanted = wanted
+        self.line_offset = None
+
+    @property
+    def offset(self):
+        return(getattr(self.gfffile, 'offset', None))
+
+    def __iter__(self):
+        tracked = hasattr(self.gfffile, 'line_offset')
+        block = []
+        keep = False
+        for line in self.gfffile:
+            row = line.split('\t', 3)
+            if len(row) < 4:
+                continue
+            if row[2] == 'gene':
+                if keep:
+                    for offset, kept in block:
+                        self.line_offset = offset
+                        yield kept
+                block = []
+                keep = False
+            elif row[2] == 'mRNA' and not keep:
+                row = line.strip().split('\t')
+                keep = len(row) == 9 and parse_desc(row[8]) in self.wanted
+            block.append((self.gfffile.line_offset if tracked else None, line))
+        if keep:
+            for offset, kept in block:
+                self.line_offset = offset
+                yield kept
+
+def gff_reader(gfffile, errout=sys.stderr, wanted=None, max_examples=5, detail=None):
+    '''
+    Build genes from a GFF ordered as described in the README. If wanted is
+    given, only genes with an mRNA in wanted are built (see GeneSelector).
+    Format errors are summarized to errout once the GFF is exhausted, with up
+    to max_examples examples per category, and every error is logged to the
+    detail file if given (see Diagnostics).
+
+    If gfffile tracks byte offsets (see checkpoint.OffsetReader), each gene's
+    end attribute is set to the offset just past it, i.e. where reading can
+    resume after the gene.
+    '''
     g = None
     valid = True
-    fc = FormatChecker(errout)
+    fc = FormatChecker(errout, max_examples, detail)
+    if wanted is not None:
+        gfffile = GeneSelector(gfffile, wanted)
     for line in gfffile:
         line = line.strip()
         d = line2gffdict(line)
@@ -67,6 +131,7 @@ def gff_reader(gfffile, errout=sys.stderr):
             # If the gene object is well formed, yield
             # Otherwise contine, writing warnings to STDERR
             if fc.check_gene(g):
+                g.end = getattr(gfffile, 'line_offset', None)
                 yield g
             g = Gene(ident, d['seqid'], d['bounds'], d['strand'])
             valid = True
@@ -83,7 +148,121 @@ def gff_reader(gfffile, errout=sys.stderr):
             g.mRNAs[-1].exons[-1].CDS = CDS(ident, d['bounds'])
 
     if fc.check_gene(g):
+        g.end = getattr(gfffile, 'offset', None)
         yield g
+    fc.report()
+
+def gff_assembler(gfffile, errout=sys.stderr, maxlines=1000000, wanted=None,
+                  max_examples=5, detail=None):
+    '''
+    Build genes from a GFF with no ordering requirements. Children are linked
+    to their parents through the Parent attribute rather than by position.
+
+    The input is streamed once into per-seqid partitions (see SeqidPartitions)
+    and each partition is then assembled independently, so at most one seqid
+    worth of features is held as objects at a time. Exons are ordered 5' to 3'
+    by strand and CDS are attached to the exon that contains them. The
+    resulting genes pass through the same FormatChecker tests as gff_reader.
+    If wanted is given, genes without an mRNA in wanted are not built.
+    Format errors are reported as by gff_reader.
+
+    The result does not depend on the order of the input lines: seqids are
+    assembled in sorted order, within a seqid genes are ordered by (start,
+    stop, ID), and the mRNAs of a gene are numbered (tid) in order of (start,
+    stop, ID).
+    '''
+    fc = FormatChecker(errout, max_examples, detail)
+    partitions = SeqidPartitions(maxlines)
+    try:
+        for line in gfffile:
+            line = line.strip()
+            row = line.split('\t')
+            if len(row) == 9:
+                partitions.add(row[0], line)
+        for seqid, lines in partitions:
+            for g in _assemble_seqid(lines, fc, wanted):
+                yield g
+        fc.report()
+    finally:
+        partitions.cleanup()
+
+def _assemble_seqid(lines, fc, wanted=None):
+    genes = collections.OrderedDict()
+    mrnas = collections.defaultdict(list)
+    exons = collections.defaultdict(list)
+    cdss = collections.defaultdict(list)
+    for line in lines:
+        d = line2gffdict(line)
+        ident = parse_desc(d['desc'])
+        if d['type'] == 'gene':
+            if not ident:
+                fc._warn('missing-id', "gene lacks identifier (ID=([^;]+))", line=line)
+            elif ident in genes:
+                fc._warn('duplicate-id', "gene '%s' is defined more than once", (ident,), line)
+            else:
+                genes[ident] = (d, line)
+        elif d['type'] in ('mRNA', 'exon', 'CDS'):
+            parents = parse_parents(d['desc'])
+            if not parents:
+                msg = "%s (%s at (%d, %d)) has no Parent"
+                fc._warn('missing-parent', msg, tuple([d['type'], d['seqid']] + d['bounds']), line)
+            children = {'mRNA': mrnas, 'exon': exons, 'CDS': cdss}[d['type']]
+            for parent in parents:
+                children[parent].append((d, ident, line))
+
+    linked = set()
+    ordered = sorted(genes.items(), key=lambda x: (x[1][0]['bounds'], x[0]))
+    for gene_ident, (gd, gline) in ordered:
+        linked.add(gene_ident)
+        if wanted is not None:
+            linked.update(x[1] for x in mrnas[gene_ident])
+            if not any(x[1] in wanted for x in mrnas[gene_ident]):
+                continue
+        g = Gene(gene_ident, gd['seqid'], gd['bounds'], gd['strand'])
+        valid = True
+        for d, ident, line in sorted(mrnas[gene_ident], key=_element_order):
+            linked.add(ident)
+            valid = fc.check_gene_element(g, d, ident, line) and valid
+            mrna = mRNA(ident, d['bounds'], g.strand)
+            valid = _link_exons(g, mrna, exons[ident], cdss[ident], fc) and valid
+            g.add_mRNA(mrna)
+        if valid and fc.check_gene(g):
+            yield g
+
+    for children in (mrnas, exons, cdss):
+        for parent, elements in children.items():
+            if parent in linked:
+                continue
+            for d, ident, line in elements:
+                msg = "%s (%s at (%d, %d)) found outside of gene context"
+                fc._warn('orphan', msg, tuple([d['type'], d['seqid']] + d['bounds']))
+
+def _element_order(element):
+    d, ident, line = element
+    return((d['bounds'], ident or ''))
+
+def _link_exons(g, mrna, exons, cdss, fc):
+    valid = True
+    # any strand but "+" is read 3' to 5', as by FormatChecker and phase
+    exons = sorted(exons, key=_element_order, reverse=bool(g.strand != "+"))
+    cdss = sorted(cdss, key=_element_order)
+    for d, ident, line in exons:
+        valid = fc.check_gene_element(g, d, ident, line) and valid
+        mrna.add_exon(Exon(ident, d['bounds']))
+    for d, ident, line in cdss:
+        valid = fc.check_gene_element(g, d, ident, line) and valid
+        hosts = [e for e in mrna.exons if a_is_within_b(d['bounds'], e.bounds)]
+        if not hosts:
+            msg = "CDS %s at (%d, %d) is not within any exon of mRNA %s"
+            fc._warn('CDS-outside-exon', msg, tuple([ident] + d['bounds'] + [mrna.ident]))
+            valid = False
+        elif hosts[0].CDS:
+            msg = "Exon %s contains more than one CDS"
+            fc._warn('multiple-CDS', msg, (hosts[0].ident,), line)
+            valid = False
+        else:
+            hosts[0].CDS = CDS(ident, d['bounds'])
+    return(valid)
 
 def phase(ebounds, cbounds, offset, isplus):
     estart, estop = ebounds if isplus else reversed(ebounds)
@@ -107,6 +286,8 @@ class Gene:
         self.bounds = bounds
         self.strand = strand
         self.mRNAs = []
+        # Byte offset just past the gene in the GFF, if known
+        self.end = None
 
     def tostr(self):
         lines = []
@@ -179,84 +360,188 @@ class CDS:
         self.ident = ident
         self.bounds = bounds
 
-class FormatChecker:
-    def __init__(self, errout=sys.stderr):
+class SeqidPartitions:
+    '''
+    Group GFF lines by seqid. At most `maxlines` lines are held in memory,
+    beyond that every buffered partition is appended to its own temporary
+    file. Iterating yields (seqid, lines) in sorted order of seqid.
+    '''
+    def __init__(self, maxlines=1000000):
+        self.maxlines = maxlines
+        self.seqids = collections.OrderedDict()
+        self.buffers = collections.defaultdict(list)
+        self.nbuffered = 0
+        self.nfiles = 0
+        self.tmpdir = None
+
+    def add(self, seqid, line):
+        if seqid not in self.seqids:
+            self.seqids[seqid] = None
+        self.buffers[seqid].append(line)
+        self.nbuffered += 1
+        if self.nbuffered >= self.maxlines:
+            self._spill()
+
+    def _spill(self):
+        if not self.tmpdir:
+            self.tmpdir = tempfile.TemporaryDirectory(prefix='pedpha-')
+        for seqid, lines in self.buffers.items():
+            if not self.seqids[seqid]:
+                self.nfiles += 1
+                self.seqids[seqid] = os.path.join(self.tmpdir.name, str(self.nfiles))
+            with open(self.seqids[seqid], 'a') as f:
+                for line in lines:
+                    print(line, file=f)
+        self.buffers.clear()
+        self.nbuffered = 0
+
+    def __iter__(self):
+        for seqid in sorted(self.seqids):
+            path = self.seqids[seqid]
+            lines = []
+            if path:
+                with open(path) as f:
+                    lines = [line.rstrip('\n') for line in f]
+            lines += self.buffers.pop(seqid, [])
+            yield (seqid, lines)
+
+    def cleanup(self):
+        if self.tmpdir:
+            self.tmpdir.cleanup()
+            self.tmpdir = None
+
+class Diagnostics:
+    '''
+    Collect FormatChecker violations. Each violation is counted under its
+    category, but its message is only formatted if it is one of the first
+    max_examples of its category, or if a detail log is open. report writes a
+    summary of the counts and examples to errout. detail is a file for the
+    full log of violations, which the caller opens and closes.
+    '''
+    def __init__(self, errout=sys.stderr, max_examples=5, detail=None):
         self.errout = errout
+        self.max_examples = max_examples
+        self.detail = detail
+        self.counts = collections.OrderedDict()
+        self.examples = collections.defaultdict(list)
+
+    def add(self, category, msg, args=(), line=None):
+        self.counts[category] = self.counts.get(category, 0) + 1
+        keep = len(self.examples[category]) < self.max_examples
+        if keep or self.detail:
+            msg = msg % args if args else msg
+            if keep:
+                self.examples[category].append((msg, line))
+            if self.detail:
+                self.detail.write('%s\t%s\t%s\n' % (category, msg, line if line else '.'))
+
+    def report(self):
+        if not self.counts:
+            return
+        print("GFF format errors, offending genes were skipped:", file=self.errout)
+        for category, count in self.counts.items():
+            print("  %s: %d" % (category, count), file=self.errout)
+            for msg, line in self.examples[category]:
+                print("    %s" % msg, file=self.errout)
+                if line:
+                    print("      %s" % line, file=self.errout)
+            if count > len(self.examples[category]):
+                print("    ... and %d more" % (count - len(self.examples[category])), file=self.errout)
 
-    def _format_warning(self, msg, line=None):
-        warnmsg = "GFF format error, skipping offending gene - %s"
-        if line:
-            warnmsg += "\n%s" % line
-        print(warnmsg % msg, file=self.errout)
+class FormatChecker:
+    def __init__(self, errout=sys.stderr, max_examples=5, detail=None):
+        self.diagnostics = Diagnostics(errout, max_examples, detail)
+
+    def _warn(self, category, msg, args=(), line=None):
+        self.diagnostics.add(category, msg, args, line)
+
+    def report(self):
+        self.diagnostics.report()
 
 
     def check_gene(self, g):
-        valid = True
         if not g:
             return False
+        valid = True
         for mrna in g.mRNAs:
-            # ASSERT mRNA is within gene
-            if not a_is_within_b(mrna.bounds, g.bounds):
-                msg = "mRNA '%s' at (%d, %d) must be within gene bounds"
-                self._format_warning(msg % tuple([mrna.ident] + mrna.bounds))
-                valid = False
-
-            priorexon = None
+            valid = self.check_mRNA(mrna.ident, mrna.bounds, g.bounds) and valid
+            prior = None
             for exon in mrna.exons:
-                # ASSERT exon is within mRNA
-                if not a_is_within_b(exon.bounds, mrna.bounds):
-                    msg = "Exon '%s' at (%d, %d) must be within parent mRNA bounds (%d, %d)"
-                    self._format_warning(msg % tuple([exon.ident] + exon.bounds + mrna.bounds))
-                    valid = False
-                    # ASSERT the exons are ordered (1 .. n), whether start
-                    # positions are increasing or decreasing depends on the strand
-
-                if priorexon:
-                    if a_overlaps_b(exon.bounds, priorexon.bounds):
-                        msg = "Exons '%s' and '%s' overlap"
-                        self._format_warning(msg % (exon.ident, priorexon.ident))
-                        valid = False
-                    if not a_is_downstream_of_b(exon.bounds[0], priorexon.bounds[1], g.strand):
-                        msg = "Exons '%s' and '%s' are out of order"
-                        self._format_warning(msg % (exon.ident, priorexon.ident))
-                        valid = False
-
+                valid = self.check_exon(exon.ident, exon.bounds, mrna.bounds, prior, g.strand) and valid
                 if exon.CDS:
-                    if not a_is_within_b(exon.CDS.bounds, exon.bounds):
-                        msg = "CDS %s at (%d, %d) must be within exon %s at (%d, %d)"
-                        self._format_warning(msg % tuple([exon.CDS.ident] + exon.CDS.bounds + [exon.ident] + exon.bounds))
-                        valid = False
+                    valid = self.check_CDS(exon.CDS.ident, exon.CDS.bounds, exon.ident, exon.bounds) and valid
+                prior = (exon.ident, exon.bounds)
+        return(valid)
 
-                priorexon = exon
+    # check_mRNA, check_exon and check_CDS take plain values rather than
+    # objects, so genes can also be checked before (or without) building them
 
+    def check_mRNA(self, ident, bounds, gene_bounds):
+        # ASSERT mRNA is within gene
+        if not a_is_within_b(bounds, gene_bounds):
+            msg = "mRNA '%s' at (%d, %d) must be within gene bounds"
+            self._warn('mRNA-outside-gene', msg, tuple([ident] + bounds))
+            return False
+        return True
+
+    def check_exon(self, ident, bounds, mrna_bounds, prior, strand):
+        '''
+        prior is the (ident, bounds) of the previous exon of the mRNA, or None
+        '''
+        valid = True
+        # ASSERT exon is within mRNA
+        if not a_is_within_b(bounds, mrna_bounds):
+            msg = "Exon '%s' at (%d, %d) must be within parent mRNA bounds (%d, %d)"
+            self._warn('exon-outside-mRNA', msg, tuple([ident] + bounds + mrna_bounds))
+            valid = False
+
+        # ASSERT the exons are ordered (1 .. n), whether start
+        # positions are increasing or decreasing depends on the strand
+        if prior:
+            prior_ident, prior_bounds = prior
+            if a_overlaps_b(bounds, prior_bounds):
+                msg = "Exons '%s' and '%s' overlap"
+                self._warn('exon-overlap', msg, (ident, prior_ident))
+                valid = False
+            if not a_is_downstream_of_b(bounds[0], prior_bounds[1], strand):
+                msg = "Exons '%s' and '%s' are out of order"
+                self._warn('exon-order', msg, (ident, prior_ident))
+                valid = False
         return(valid)
 
+    def check_CDS(self, ident, bounds, exon_ident, exon_bounds):
+        if not a_is_within_b(bounds, exon_bounds):
+            msg = "CDS %s at (%d, %d) must be within exon %s at (%d, %d)"
+            self._warn('CDS-outside-exon', msg, tuple([ident] + bounds + [exon_ident] + exon_bounds))
+            return False
+        return True
+
     def check_gene_element(self, g, d, ident, line):
         valid = True
         # ASSERT the new element is properly placed within the gene
         if g and d['type'] in ('mRNA', 'CDS', 'exon'):
             if not ident:
-                msg = "%s lacks identifier (ID=([^;]+))" % d['type']
-                self._format_warning(msg, line)
+                msg = "%s lacks identifier (ID=([^;]+))"
+                self._warn('missing-id', msg, (d['type'],), line)
                 valid = False
 
             # ASSERT children are on same strand as parent gene
             if not d['strand'] == g.strand:
-                self._format_warning("All gene elements must be on same strand", line)
+                self._warn('strand-mismatch', "All gene elements must be on same strand", line=line)
                 valid = False
             # ASSERT the seqid, i.e. the sequence to which the gff maps the
             # entry, is same in parent and child
             if not d['seqid'] == g.seqid:
-                self._format_warning("mRNA is not from same sequence as expected parent", line)
+                self._warn('seqid-mismatch', "mRNA is not from same sequence as expected parent", line=line)
                 valid = False
             # ASSERT child is within the parent interval
             if not a_is_within_b(d['bounds'], g.bounds):
-                self._format_warning("All gene elements must be within gene boundaries gene", line)
+                self._warn('outside-gene', "All gene elements must be within gene boundaries gene", line=line)
                 valid = False
 
         if d['type'] in ('mRNA', 'CDS', 'exon') and not g:
             msg = "%s (%s at (%d, %d)) found outside of gene context"
-            self._format_warning(msg % tuple([d['type'], d['seqid']] + d['bounds']))
+            self._warn('orphan', msg, tuple([d['type'], d['seqid']] + d['bounds']))
             valid = False
 
         return(valid)
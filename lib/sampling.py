@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+'''
+Draw a uniform random sample of genes from a GFF without building the others,
+and estimate proportions over the sampled genes with confidence intervals.
+
+A gene is sampled as its block of lines, from its gene line up to the next
+gene line, which can be passed on to gffreader.gff_reader. Either the whole
+file is scanned once, looking only at the type column, and reservoir sampling
+picks the blocks, or a gene index (one byte offset per gene line) is used to
+seek straight to the sampled blocks.
+
+The first line of a gene index records the size and modification time of the
+GFF it was built from, so an index left over from another version of the GFF
+can be detected (see gff_stamp) rather than used to seek to the wrong lines.
+'''
+
+import math
+import os
+
+def gene_offsets(gfffile):
+    '''
+    Return the byte offset of every gene line, where gfffile is a
+    checkpoint.OffsetReader
+    '''
+    offsets = []
+    for line in gfffile:
+        row = line.split('\t', 3)
+        if len(row) > 3 and row[2] == 'gene':
+            offsets.append(gfffile.line_offset)
+    return(offsets)
+
+def reservoir_sample(gfffile, k, rng):
+    '''
+    Return (blocks, n): k gene blocks sampled uniformly from the n genes in
+    gfffile, in file order
+    '''
+    reservoir = []
+    block = None
+    n = 0
+    for line in gfffile:
+        row = line.split('\t', 3)
+        if len(row) > 3 and row[2] == 'gene':
+            n += 1
+            block = [line]
+            if n <= k:
+                reservoir.append((n, block))
+            else:
+                j = rng.randrange(n)
+                if j < k:
+                    reservoir[j] = (n, block)
+                else:
+                    block = None
+        elif block is not None:
+            block.append(line)
+    return([b for _, b in sorted(reservoir)], n)
+
+def indexed_sample(handle, offsets, k, rng):
+    '''
+    Return (blocks, n) as reservoir_sample, reading only the sampled genes
+    from the binary file handle using the gene offsets. The sample depends
+    only on the offsets and rng, not on how the offsets were obtained.
+    '''
+    n = len(offsets)
+    blocks = []
+    for i in sorted(rng.sample(range(n), min(k, n))):
+        handle.seek(offsets[i])
+        if i + 1 < n:
+            data = handle.read(offsets[i + 1] - offsets[i])
+        else:
+            data = handle.read()
+        blocks.append(data.decode().splitlines(True))
+    return(blocks, n)
+
+def gff_stamp(gffpath):
+    '''
+    Return the (size, mtime in ns) of the GFF, which identify the version of
+    it that a gene index was built from
+    '''
+    stat = os.stat(gffpath)
+    return((stat.st_size, stat.st_mtime_ns))
+
+def read_gene_index(indexfile):
+    '''
+    Return (stamp, offsets), where stamp is the gff_stamp recorded in the
+    index, or None if the index has none
+    '''
+    with open(indexfile) as f:
+        header = f.readline()
+        offsets = [int(line) for line in f]
+    if header.startswith('#'):
+        return(tuple(int(x) for x in header[1:].split()), offsets)
+    return(None, [int(header)] + offsets if header else offsets)
+
+def write_gene_index(indexfile, offsets, stamp):
+    with open(indexfile, 'w') as f:
+        print('#%d %d' % stamp, file=f)
+        for offset in offsets:
+            print(offset, file=f)
+
+def ratio_estimate(pairs, total, z=1.96):
+    '''
+    Estimate sum(y) / sum(x) over a population of total genes from the (y, x)
+    pairs of a simple random sample of them. Genes are the sampling unit, so
+    the standard error is that of a ratio estimator with a finite population
+    correction. Returns (estimate, lower, upper), or None if no gene in the
+    sample has x > 0.
+    '''
+    n = len(pairs)
+    sumx = sum(x for y, x in pairs)
+    if not sumx:
+        return(None)
+    r = sum(y for y, x in pairs) / sumx
+    if n < 2:
+        return((r, 0.0, 1.0))
+    s2 = sum((y - r * x) ** 2 for y, x in pairs) / (n - 1)
+    fpc = max(0.0, 1 - n / total)
+    se = math.sqrt(fpc * s2 / n) / (sumx / n)
+    return((r, max(0.0, r - z * se), min(1.0, r + z * se)))
@@ -2,12 +2,29 @@
 # -*- coding: utf-8 -*-
 
 import lib.gffreader as reader
+import lib.fasta as fasta
+import lib.extsort as extsort
+import lib.columnar as columnar
+import lib.checkpoint as checkpoint
+import lib.engine as engine
+import lib.sampling as sampling
 import sys
+import os
+import random
 import argparse
 import collections
+import itertools
 
 __version__ = "1.2.0"
 
+ROW_FORMAT = "%s %s %s %s %s %d %d %d %d %d %d %s"
+
+
+def positive_int(x):
+    value = int(x)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %s" % x)
+    return(value)
 
 def parse(argv=None):
     parser = argparse.ArgumentParser(prog='pedpha')
@@ -34,6 +51,131 @@ def parse(argv=None):
         help="INTER file delimiter (defaults to whitespace)",
         metavar="DEL"
     )
+    parser.add_argument(
+        '-u', '--unordered',
+        help="""The GFF elements may be in any order. Children are linked to
+                their parents through the Parent attribute, so the file need
+                not be sorted into gene, mRNA, exon, CDS order.""",
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-G', '--genome',
+        help="""Genome FASTA file. It is indexed faidx-style (FASTA.fai,
+                built if missing) and memory-mapped. Instead of the interval
+                table, write a FASTA file of the spliced CDS sequence of each
+                mapped interval.""",
+        metavar="FASTA"
+    )
+    parser.add_argument(
+        '-t', '--translate',
+        help="With --genome, write the translated peptide rather than the CDS",
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '--coalesce',
+        help="""Map identical intervals of an mRNA only once (dedup), or map
+                overlapping intervals once as their union and clip the result
+                back to each interval (merge). Output is unchanged.""",
+        choices=['dedup', 'merge']
+    )
+    parser.add_argument(
+        '-s', '--sort',
+        help="""Sort the interval table by genomic coordinate. Each row then
+                starts with seqid, absolute start and absolute end, followed
+                by the other columns in their usual order.""",
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '--sort-memory',
+        help="Memory ceiling for --sort, in megabytes (default 512)",
+        metavar="MB",
+        type=positive_int,
+        default=512
+    )
+    parser.add_argument(
+        '--sort-index',
+        help="With --sort, write a block index of the sorted output to this file",
+        metavar="INDEX",
+        type=argparse.FileType('w')
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help="Write the interval table or exonstat output to this file",
+        metavar="OUT"
+    )
+    parser.add_argument(
+        '--checkpoint',
+        help="""Periodically record progress to this file, so an interrupted
+                run can be continued with --resume. Requires --gff and
+                --output, and is not available with --unordered, --sort,
+                --genome, --classify-domains, --threads or --sample. Resuming exits with an error if the GFF, the
+                interval file or the options differ from the checkpointed
+                run, or if the output is missing.""",
+        metavar="FILE"
+    )
+    parser.add_argument(
+        '--checkpoint-every',
+        help="Genes between checkpoints (default 1000)",
+        metavar="N",
+        type=positive_int,
+        default=1000
+    )
+    parser.add_argument(
+        '--resume',
+        help="""Continue from the --checkpoint file: skip the genes already
+                written and drop any partial output after them""",
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '-j', '--threads',
+        help="""Map intervals (or, without --intervals, compute exon phases)
+                on N threads sharing one in-memory annotation. Threads run
+                in parallel only on free-threaded Python builds; on standard
+                builds the work runs in a single thread.""",
+        metavar="N",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '--sample',
+        help="""Instead of the usual output, estimate the exon phase
+                distributions (and, with --intervals, the fraction of
+                intervals that map to an exon) from K randomly sampled genes,
+                with confidence intervals. The GFF must be ordered (not
+                --unordered).""",
+        metavar="K",
+        type=positive_int
+    )
+    parser.add_argument(
+        '--seed',
+        help="Random seed for --sample",
+        type=int
+    )
+    parser.add_argument(
+        '--gene-index',
+        help="""With --sample and --gff, read sampled genes directly using
+                this index of gene offsets. If it does not exist, or was
+                built from a different version of the GFF, it is (re)written
+                during the sampling scan.""",
+        metavar="INDEX"
+    )
+    parser.add_argument(
+        '--max-examples',
+        help="""Number of example messages to report for each kind of GFF
+                format error (default 5). All errors are counted.""",
+        metavar="N",
+        type=int,
+        default=5
+    )
+    parser.add_argument(
+        '--diagnostics',
+        help="Write every GFF format error to this file",
+        metavar="FILE"
+    )
     parser.add_argument(
         '-c', '--classify-domains',
         help="""Write domain classifications to this file.
@@ -89,51 +231,363 @@ def get_overlap(x, y, minus=False):
 
         return((a,b))
 
-def phaser(gff, intervals, delimiter=None):
+def read_genes(gff, unordered=False, wanted=None, diagnostics=None):
+    '''
+    diagnostics is a dict of the format error reporting options of the
+    readers (max_examples, detail), the reader defaults are used if None
+    '''
+    options = diagnostics if diagnostics else {}
+    if unordered:
+        return(reader.gff_assembler(gff, wanted=wanted, **options))
+    else:
+        return(reader.gff_reader(gff, wanted=wanted, **options))
+
+def mapped_mrnas(gff, intervals, delimiter=None, unordered=False, coalesce=None,
+                 diagnostics=None):
+    '''
+    Yield (gene, mrna, rows) for every mRNA, where rows iterates over the
+    mapped intervals of mrna (see map_mrna)
+    '''
     inter = Intervals(intervals, delimiter)
-    for gene in reader.gff_reader(gff):
+    for gene in read_genes(gff, unordered, inter, diagnostics):
         for mrna in gene.mRNAs:
-            # TODO this should be automatic
-            mrna.calculate_phases()
-            domcount = collections.Counter()
-            for domid, bounds in inter.get_bounds(mrna.ident):
-                # Undefined when no interval maps to the current mRNA
-                if not bounds:
+            yield (gene, mrna, map_mrna(gene, mrna, inter, coalesce))
+
+def phaser(gff, intervals, delimiter=None, unordered=False, coalesce=None,
+           diagnostics=None):
+    for gene, mrna, rows in mapped_mrnas(gff, intervals, delimiter, unordered,
+                                         coalesce, diagnostics):
+        for row in rows:
+            yield row
+
+def coalesce_bounds(bounds, merge=False):
+    '''
+    Map each distinct interval in bounds to the range that will be mapped in
+    its place: itself, or, if merge is True, the union of all intervals it
+    overlaps
+    '''
+    ranges = {}
+    merged = []
+    for x in sorted(set(bounds)):
+        if merge and merged and x[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], x[1])
+            merged[-1][2].append(x)
+        else:
+            merged.append([x[0], x[1], [x]])
+    for a, b, members in merged:
+        for x in members:
+            ranges[x] = (a, b)
+    return(ranges)
+
+def mapped_segments(gene, mrna, inter, coalesce=None):
+    '''
+    Yield (domid, occurrence, segments) for each interval of mrna, where
+    segments are the exon pieces of the interval as returned by map_bounds. If
+    coalesce is 'dedup', identical intervals are mapped once; if 'merge',
+    overlapping intervals are mapped once as their union and clipped back to
+    each original interval.
+    '''
+    # Phases are only needed, and so only calculated, for transcripts that
+    # have intervals
+    if mrna.ident not in inter:
+        return
+    mrna.calculate_phases()
+    minus = bool(gene.strand == "-")
+    domcount = collections.Counter()
+    intervals = list(inter.get_bounds(mrna.ident))
+    if coalesce:
+        ranges = coalesce_bounds([x[1] for x in intervals], bool(coalesce == 'merge'))
+        mapped = {}
+    for domid, bounds in intervals:
+        domcount[domid] += 1
+        if not coalesce:
+            segments = map_bounds(mrna, bounds, minus)
+        else:
+            key = ranges[bounds]
+            if key not in mapped:
+                mapped[key] = map_bounds(mrna, key, minus)
+            segments = mapped[key]
+            if key != bounds:
+                segments = clip_segments(segments, bounds, minus)
+        yield (domid, domcount[domid], segments)
+
+def map_mrna(gene, mrna, inter, coalesce=None):
+    '''
+    Yield one row per exon overlapped by each interval of mrna (see
+    mapped_segments)
+    '''
+    for domid, occurrence, segments in mapped_segments(gene, mrna, inter, coalesce):
+        for exon, a, b, ca, cb in segments:
+            yield (
+                mrna.ident,
+                exon.num,
+                domid,
+                occurrence,
+                gene.strand,
+                exon.bounds[0],
+                exon.bounds[1],
+                a, b,
+                ca, cb,
+                '%s-%s' % exon.phase
+                )
+
+def map_bounds(mrna, bounds, minus=False):
+    '''
+    Map a DNA interval, numbered relative to the start of the CDS, to the
+    exons of mrna. Returns a list of (exon, a, b, ca, cb) where (a, b) are the
+    genomic and (ca, cb) the CDS-relative coordinates of each piece.
+    '''
+    bounds = list(bounds)
+    segments = []
+    total, cds_length = 0, 0
+    for exon in mrna.exons:
+        if not exon.CDS:
+            continue
+
+        a,b = get_overlap(bounds, exon.CDS.bounds, minus)
+
+        if a and b:
+            if not minus:
+                ca, cb = sorted(i - exon.CDS.bounds[0] + total + 1 for i in (a,b))
+            else:
+                ca, cb = sorted(exon.CDS.bounds[1] - i + total + 1 for i in (a,b))
+            segments.append((exon, a, b, ca, cb))
+
+        cds_length = exon.CDS.bounds[1] - exon.CDS.bounds[0] + 1
+        total += cds_length
+        bounds[0] = 1 if (a and b) else bounds[0] - cds_length
+        bounds[1] -= cds_length
+
+        if bounds[1] < 1:
+            break
+    return(segments)
+
+def clip_segments(segments, bounds, minus=False):
+    '''
+    Restrict segments from map_bounds to the CDS-relative interval bounds
+    '''
+    clipped = []
+    for exon, a, b, ca, cb in segments:
+        lo, hi = max(ca, bounds[0]), min(cb, bounds[1])
+        if lo > hi:
+            continue
+        if minus:
+            clipped.append((exon, a + cb - hi, b - lo + ca, lo, hi))
+        else:
+            clipped.append((exon, a + lo - ca, b - cb + hi, lo, hi))
+    return(clipped)
+
+def sequencer(gff, intervals, genome, delimiter=None, unordered=False,
+              translate=False, coalesce=None, diagnostics=None):
+    '''
+    Yield (header, sequence) for every mapped interval, where sequence is the
+    spliced, strand-corrected CDS sequence pulled from the indexed genome
+    (or its translation if translate is True)
+    '''
+    for gene, mrna, rows in mapped_mrnas(gff, intervals, delimiter, unordered,
+                                         coalesce, diagnostics):
+        for (domid, domnum), segments in itertools.groupby(rows, lambda r: r[2:4]):
+            seq = ''.join(genome.fetch(gene.seqid, r[7], r[8], gene.strand) for r in segments)
+            if translate:
+                seq = fasta.translate(seq)
+            yield ('%s|%s|%d' % (mrna.ident, domid, domnum), seq)
+
+
+PHASER_COLUMNS = ('mrna', 'exon', 'domain', 'occurrence', 'strand',
+                  'exon_start', 'exon_stop', 'start', 'stop',
+                  'cds_start', 'cds_stop', 'phase')
+
+def phaser_batches(gff, intervals, size=65536, delimiter=None, unordered=False,
+                   coalesce=None, diagnostics=None):
+    '''
+    Yield phaser results as columnar.Batch objects of at most size rows, with
+    one array per column of PHASER_COLUMNS. The mrna, domain, strand and
+    phase columns are dictionary-encoded.
+
+    The segments of each mapped interval are appended straight into the
+    column arrays, without building a row tuple, and the mrna, domain and
+    strand codes are looked up once per interval rather than once per row.
+    '''
+    inter = Intervals(intervals, delimiter)
+    encoded = ('mrna', 'domain', 'strand', 'phase')
+    dictionaries = {name: columnar.Dictionary() for name in encoded}
+    batch = columnar.Batch(PHASER_COLUMNS, encoded, dictionaries)
+    for gene in read_genes(gff, unordered, inter, diagnostics):
+        for mrna in gene.mRNAs:
+            for domid, occurrence, segments in mapped_segments(gene, mrna, inter, coalesce):
+                if not segments:
                     continue
-                domcount[domid] += 1
-                total, cds_length = 0, 0
-                for exon in mrna.exons:
-                    if not exon.CDS:
-                        continue
-
-                    a,b = get_overlap(bounds, exon.CDS.bounds, bool(gene.strand == "-"))
-
-                    if a and b:
-                        if gene.strand == "+":
-                            ca, cb = sorted(i - exon.CDS.bounds[0] + total + 1 for i in (a,b))
-                        else:
-                            ca, cb = sorted(exon.CDS.bounds[1] - i + total + 1 for i in (a,b))
-
-                        yield (
-                            mrna.ident,
-                            exon.num,
-                            domid,
-                            domcount[domid],
-                            gene.strand,
-                            exon.bounds[0],
-                            exon.bounds[1],
-                            a, b,
-                            ca, cb,
-                            '%s-%s' % exon.phase
-                            )
-
-                    cds_length = exon.CDS.bounds[1] - exon.CDS.bounds[0] + 1
-                    total += cds_length
-                    bounds[0] = 1 if (a and b) else bounds[0] - cds_length
-                    bounds[1] -= cds_length
-
-                    if bounds[1] < 1:
-                        break
+                mrna_code = dictionaries['mrna'].encode(mrna.ident)
+                domain = dictionaries['domain'].encode(domid)
+                strand = dictionaries['strand'].encode(gene.strand)
+                for exon, a, b, ca, cb in segments:
+                    c = batch.columns
+                    c['mrna'].append(mrna_code)
+                    c['exon'].append(exon.num)
+                    c['domain'].append(domain)
+                    c['occurrence'].append(occurrence)
+                    c['strand'].append(strand)
+                    c['exon_start'].append(exon.bounds[0])
+                    c['exon_stop'].append(exon.bounds[1])
+                    c['start'].append(a)
+                    c['stop'].append(b)
+                    c['cds_start'].append(ca)
+                    c['cds_stop'].append(cb)
+                    c['phase'].append(dictionaries['phase'].encode('%s-%s' % exon.phase))
+                    if len(batch) >= size:
+                        yield batch
+                        batch = columnar.Batch(PHASER_COLUMNS, encoded, dictionaries)
+    if len(batch):
+        yield batch
+
+def sorted_phaser(gff, intervals, delimiter=None, unordered=False,
+                  coalesce=None, memory=512*2**20, tmpdir=None, diagnostics=None):
+    '''
+    Yield (seqid, start, stop, rest) for every phaser row, sorted by genomic
+    coordinate, where rest holds the remaining fields as text
+    '''
+    sorter = extsort.ExternalSorter(memory, tmpdir)
+    for gene, mrna, rows in mapped_mrnas(gff, intervals, delimiter, unordered,
+                                         coalesce, diagnostics):
+        for row in rows:
+            rest = "%s %s %s %s %s %d %d %d %d %s" % (row[0:7] + row[9:12])
+            sorter.add(gene.seqid, row[7], row[8], rest)
+    return(iter(sorter))
+
+
+def phaser_blocks(gff, intervals, delimiter=None, coalesce=None, diagnostics=None):
+    '''
+    Yield (gene, lines) with the formatted phaser rows of each gene
+    '''
+    mapped = mapped_mrnas(gff, intervals, delimiter, coalesce=coalesce,
+                          diagnostics=diagnostics)
+    for gene, group in itertools.groupby(mapped, lambda x: x[0]):
+        yield (gene, [ROW_FORMAT % row for _, _, rows in group for row in rows])
+
+def threaded_phaser(gff, intervals, threads, delimiter=None, unordered=False,
+                    coalesce=None, batchsize=256, diagnostics=None):
+    '''
+    Yield formatted phaser rows. The genes and the Intervals index are built
+    once and shared, read-only, by a pool of threads that each map a batch of
+    mRNAs (see lib.engine).
+    '''
+    inter = Intervals(intervals, delimiter)
+    mrnas = [(gene, mrna) for gene in read_genes(gff, unordered, inter, diagnostics)
+                          for mrna in gene.mRNAs]
+    def work(batch):
+        return([ROW_FORMAT % row for gene, mrna in batch
+                                 for row in map_mrna(gene, mrna, inter, coalesce)])
+    for lines in engine.run_batches(work, mrnas, threads, batchsize):
+        for line in lines:
+            yield line
+
+def threaded_exonstat(gff, threads, unordered=False, batchsize=256, diagnostics=None):
+    '''
+    Yield exonstat lines, formatting batches of genes on a pool of threads
+    '''
+    genes = list(read_genes(gff, unordered, diagnostics=diagnostics))
+    def work(batch):
+        return([line for gene in batch for line in gene.tostr()])
+    for lines in engine.run_batches(work, genes, threads, batchsize):
+        for line in lines:
+            yield line
+
+def sample_genes(gff, k, seed=None, gene_index=None):
+    '''
+    Return (blocks, n): the lines of k genes sampled uniformly from the n genes
+    in gff, using (or creating) gene_index if given
+    '''
+    rng = random.Random(seed)
+    if gene_index:
+        stamp = sampling.gff_stamp(gff.name)
+        if os.path.exists(gene_index):
+            indexed, offsets = sampling.read_gene_index(gene_index)
+            if indexed == stamp:
+                with open(gff.name, 'rb') as handle:
+                    return(sampling.indexed_sample(handle, offsets, k, rng))
+            print("Gene index '%s' does not match the GFF, rebuilding it" % gene_index,
+                  file=sys.stderr)
+        # draw from the new index, so the same seed gives the same sample on
+        # this run and on later runs that read the index
+        with open(gff.name, 'rb') as handle:
+            offsets = sampling.gene_offsets(checkpoint.OffsetReader(handle))
+            sampling.write_gene_index(gene_index, offsets, stamp)
+            handle.seek(0)
+            return(sampling.indexed_sample(handle, offsets, k, rng))
+    else:
+        return(sampling.reservoir_sample(gff, k, rng))
+
+def sample_stats(gff, k, intervals=None, seed=None, gene_index=None, delimiter=None,
+                 z=1.96, diagnostics=None):
+    '''
+    Estimate statistics from k sampled genes. Returns a list of
+    (statistic, estimate, lower, upper), skipping statistics that are
+    undefined in the sample:
+
+     * phase5_P - fraction of exons with a defined 5' phase where it is P
+     * phase3_P - as phase5_P for the 3' phase
+     * mapped   - fraction of intervals that map to at least one exon
+    '''
+    blocks, total = sample_genes(gff, k, seed, gene_index)
+    inter = Intervals(intervals, delimiter) if intervals else None
+    counts = collections.defaultdict(list)
+    genes = read_genes(itertools.chain.from_iterable(blocks), diagnostics=diagnostics)
+    for gene in genes:
+        c = collections.Counter()
+        for mrna in gene.mRNAs:
+            mrna.calculate_phases()
+            for exon in mrna.exons:
+                for end, p in zip((5, 3), exon.phase if exon.CDS else ()):
+                    if p != ".":
+                        c['phase%d' % end] += 1
+                        c['phase%d_%d' % (end, p)] += 1
+            if inter:
+                domains = {(r[2], r[3]) for r in map_mrna(gene, mrna, inter)}
+                c['mapped'] += len(domains)
+                c['intervals'] += len(list(inter.get_bounds(mrna.ident)))
+        for end in (5, 3):
+            for p in range(3):
+                counts['phase%d_%d' % (end, p)].append((c['phase%d_%d' % (end, p)], c['phase%d' % end]))
+        if inter:
+            counts['mapped'].append((c['mapped'], c['intervals']))
+    stats = []
+    for name, pairs in counts.items():
+        estimate = sampling.ratio_estimate(pairs, total, z)
+        if estimate:
+            stats.append((name,) + estimate)
+    return(stats)
+
+def checkpoint_run(args):
+    '''
+    Describe the run for its checkpoints: the GFF, and the interval file
+    (by its content) and options that change the output
+    '''
+    options = {
+        'intervals': None,
+        'delimiter': args.delimiter,
+        'coalesce': args.coalesce
+    }
+    if args.intervals:
+        options['intervals'] = checkpoint.file_digest(args.intervals.name)
+    return(checkpoint.describe_run(args.gff.name, options))
+
+def run_checkpointed(args, diagnostics=None):
+    if not (args.gff and args.output):
+        sys.exit("--checkpoint requires --gff and --output files")
+    if (args.unordered or args.sort or args.genome or args.classify_domains
+            or args.threads > 1 or args.sample):
+        sys.exit("--checkpoint cannot be used with --unordered, --sort, --genome, "
+                 "--classify-domains, --threads or --sample")
+    cp = checkpoint.Checkpoint(args.checkpoint, args.checkpoint_every, checkpoint_run(args))
+    gff, out = cp.open(args.gff.name, args.output, args.resume)
+    if args.intervals:
+        blocks = phaser_blocks(gff, args.intervals, args.delimiter, args.coalesce,
+                               diagnostics)
+    else:
+        blocks = ((gene, gene.tostr()) for gene in read_genes(gff, diagnostics=diagnostics))
+    checkpoint.write_checkpointed(blocks, out, cp)
+    gff.close()
+    out.close()
 
 
 class Intervals:
@@ -147,7 +601,7 @@ class Intervals:
             try:
                 seqid, domid = row[0:2]
                 start, stop = (int(s) for s in row[2:4])
-                bounds = to_dna_interval(sorted([start, stop]))
+                bounds = tuple(to_dna_interval(sorted([start, stop])))
                 value = (domid, bounds)
                 out[seqid].append(value)
                 if start < 1 or stop < 1:
@@ -158,12 +612,12 @@ class Intervals:
                 sys.exit("Interval coordinants must be integers greater than 0")
         return(out)
 
+    def __contains__(self, ident):
+        return(ident in self.intervals)
+
     def get_bounds(self, ident):
-        try:
-            for val in self.intervals[ident]:
-                yield val
-        except KeyError:
-            yield None
+        for val in self.intervals.get(ident, []):
+            yield val
 
 class ClassifyDomains:
     def __init__(self, gff, intervals):
@@ -200,14 +654,68 @@ if __name__ == '__main__':
 
     gff = args.gff if args.gff else sys.stdin
 
-    if args.intervals:
-        if args.classify_domains:
-            cd = ClassifyDomains(gff, args.intervals)
-
-        else:
-            for row in phaser(gff, args.intervals):
-                print("%s %s %s %s %s %d %d %d %d %d %d %s" % row)
-    else:
-        for gene in reader.gff_reader(gff):
-            for line in gene.tostr():
+    detail = open(args.diagnostics, 'w', buffering=2**20) if args.diagnostics else None
+    diagnostics = {'max_examples': args.max_examples, 'detail': detail}
+
+    try:
+        if args.checkpoint:
+            run_checkpointed(args, diagnostics)
+            sys.exit()
+
+        args.threads = engine.usable_threads(args.threads)
+
+        if args.sample:
+            if args.unordered:
+                sys.exit("--sample cannot be used with --unordered")
+            if args.gene_index and not args.gff:
+                sys.exit("--gene-index requires --gff")
+            for stat in sample_stats(gff, args.sample, args.intervals, args.seed,
+                                     args.gene_index, args.delimiter,
+                                     diagnostics=diagnostics):
+                print("%s %.4f %.4f %.4f" % stat)
+            sys.exit()
+
+        if args.output:
+            sys.stdout = open(args.output, 'w')
+
+        if args.intervals:
+            if args.classify_domains:
+                cd = ClassifyDomains(gff, args.intervals)
+
+            elif args.genome:
+                genome = fasta.IndexedFasta(args.genome)
+                for header, seq in sequencer(gff, args.intervals, genome,
+                                             args.delimiter, args.unordered,
+                                             args.translate, args.coalesce,
+                                             diagnostics):
+                    fasta.write_fasta(header, seq)
+                genome.close()
+
+            elif args.sort:
+                records = sorted_phaser(gff, args.intervals, args.delimiter,
+                                        args.unordered, args.coalesce,
+                                        args.sort_memory * 2**20,
+                                        diagnostics=diagnostics)
+                extsort.write_sorted(records, sys.stdout, args.sort_index)
+
+            elif args.threads > 1:
+                for line in threaded_phaser(gff, args.intervals, args.threads,
+                                            args.delimiter, args.unordered,
+                                            args.coalesce, diagnostics=diagnostics):
+                    print(line)
+
+            else:
+                for row in phaser(gff, args.intervals, args.delimiter,
+                                  args.unordered, args.coalesce, diagnostics):
+                    print(ROW_FORMAT % row)
+        elif args.threads > 1:
+            for line in threaded_exonstat(gff, args.threads, args.unordered,
+                                          diagnostics=diagnostics):
                 print(line)
+        else:
+            for gene in read_genes(gff, args.unordered, diagnostics=diagnostics):
+                for line in gene.tostr():
+                    print(line)
+    finally:
+        if detail:
+            detail.close()
@@ -1,8 +1,22 @@
 #!/usr/bin/env python3
 import lib.gffreader as gffreader
+import lib.fasta as fasta
+import lib.extsort as extsort
+import lib.columnar as columnar
+import lib.checkpoint as checkpoint
+import lib.engine as engine
+import lib.sampling as sampling
+import itertools
+import collections
 import pedpha
 import unittest
+import io
+import tempfile
+import random
 import os
+import contextlib
+import subprocess
+import sys
 
 # ================
 # gff_reader tests
@@ -19,66 +33,258 @@ def prepare_gff(gff, addnew=True):
 
     return(gff)
 
-def readgff(gfflist, addnew=True):
+def readgff(gfflist, addnew=True, reader=gffreader.gff_reader, **kwargs):
     gff = prepare_gff(gfflist, addnew=addnew)
 
     out = []
     with open(os.devnull, 'w') as errout:
-        for gene in gffreader.gff_reader(gff, errout=errout):
+        for gene in reader(gff, errout=errout, **kwargs):
             for line in gene.tostr():
                 out.append(line)
     return(out)
 
+GOOD = [
+    ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+    ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1'],
+    ['s1', '.', 'exon', '100', '109', '.', '+', '.', 'ID=a.1.exon.1'],
+    ['s1', '.', 'exon', '110', '200', '.', '+', '.', 'ID=a.1.exon.2'],
+    ['s1', '.', 'CDS', '150', '200', '.', '+', '.', 'ID=a.1.cds.1'],
+    ['s1', '.', 'exon', '300', '400', '.', '+', '.', 'ID=a.1.exon.3'],
+    ['s1', '.', 'CDS', '300', '400', '.', '+', '.', 'ID=a.1.cds.2'],
+    ['s1', '.', 'exon', '600', '900', '.', '+', '.', 'ID=a.1.exon.4'],
+    ['s1', '.', 'CDS', '600', '603', '.', '+', '.', 'ID=a.1.cds.2'],
+    ['s1', '.', 'exon', '910', '930', '.', '+', '.', 'ID=a.1.exon.5']
+]
+GOOD_OUTPUT = [
+    ['s1', 'a.1', '1', '1', '1000', '+', '1', 'a.1.exon.1', '100', '109', '.', '.', '.', '.'],
+    ['s1', 'a.1', '1', '1', '1000', '+', '2', 'a.1.exon.2', '110', '200', '150', '200', '.', '0'],
+    ['s1', 'a.1', '1', '1', '1000', '+', '3', 'a.1.exon.3', '300', '400', '300', '400', '0', '2'],
+    ['s1', 'a.1', '1', '1', '1000', '+', '4', 'a.1.exon.4', '600', '900', '600', '603', '2', '.'],
+    ['s1', 'a.1', '1', '1', '1000', '+', '5', 'a.1.exon.5', '910', '930', '.', '.', '.', '.']
+]
+GOOD_OUTPUT = [' '.join(s) for s in GOOD_OUTPUT]
+
+MINUS = [
+    ['s1', '.', 'gene', '1',   '1000', '.', '-', '.', 'ID=a'],
+    ['s1', '.', 'mRNA', '1',   '1000', '.', '-', '.', 'ID=a.1'],
+    ['s1', '.', 'exon', '800', '900',  '.', '-', '.', 'ID=a.1.exon.1'],
+    ['s1', '.', 'exon', '600', '700',  '.', '-', '.', 'ID=a.1.exon.2'],
+    ['s1', '.', 'CDS',  '600', '650',  '.', '-', '.', 'ID=a.1.cds.1'],
+    ['s1', '.', 'exon', '400', '500',  '.', '-', '.', 'ID=a.1.exon.3'],
+    ['s1', '.', 'CDS',  '400', '500',  '.', '-', '.', 'ID=a.1.cds.2'],
+    ['s1', '.', 'exon', '200', '300',  '.', '-', '.', 'ID=a.1.exon.4'],
+    ['s1', '.', 'CDS',  '297', '300',  '.', '-', '.', 'ID=a.1.cds.2'],
+    ['s1', '.', 'exon', '10',  '150',  '.', '-', '.', 'ID=a.1.exon.5']
+]
+MINUS_OUTPUT = [
+    ['s1', 'a.1', '1', '1', '1000', '-', '1', 'a.1.exon.1', '800', '900',   '.',   '.', '.', '.'],
+    ['s1', 'a.1', '1', '1', '1000', '-', '2', 'a.1.exon.2', '600', '700', '600', '650', '.', '0'],
+    ['s1', 'a.1', '1', '1', '1000', '-', '3', 'a.1.exon.3', '400', '500', '400', '500', '0', '2'],
+    ['s1', 'a.1', '1', '1', '1000', '-', '4', 'a.1.exon.4', '200', '300', '297', '300', '2', '.'],
+    ['s1', 'a.1', '1', '1', '1000', '-', '5', 'a.1.exon.5', '10',  '150',   '.',   '.', '.', '.']
+]
+MINUS_OUTPUT = [' '.join(s) for s in MINUS_OUTPUT]
+
+def make_genes(strands, prefix='g'):
+    '''
+    Return the rows of one gene per strand in strands, copies of GOOD for "+"
+    and MINUS for "-", with gene "a" renamed <prefix>0, <prefix>1, ...
+    '''
+    gff = []
+    for i, strand in enumerate(strands):
+        for row in (GOOD if strand == "+" else MINUS):
+            gff.append(row[:8] + [row[8].replace('ID=a', 'ID=%s%d' % (prefix, i))])
+    return(gff)
+
 
 class Test_gffreader(unittest.TestCase):
     def setUp(self):
-        self.good = [
-            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
-            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1'],
-            ['s1', '.', 'exon', '100', '109', '.', '+', '.', 'ID=a.1.exon.1'],
-            ['s1', '.', 'exon', '110', '200', '.', '+', '.', 'ID=a.1.exon.2'],
-            ['s1', '.', 'CDS', '150', '200', '.', '+', '.', 'ID=a.1.cds.1'],
-            ['s1', '.', 'exon', '300', '400', '.', '+', '.', 'ID=a.1.exon.3'],
-            ['s1', '.', 'CDS', '300', '400', '.', '+', '.', 'ID=a.1.cds.2'],
-            ['s1', '.', 'exon', '600', '900', '.', '+', '.', 'ID=a.1.exon.4'],
-            ['s1', '.', 'CDS', '600', '603', '.', '+', '.', 'ID=a.1.cds.2'],
-            ['s1', '.', 'exon', '910', '930', '.', '+', '.', 'ID=a.1.exon.5']
-        ]
-        self.good_output = [
-            ['s1', 'a.1', '1', '1', '1000', '+', '1', 'a.1.exon.1', '100', '109', '.', '.', '.', '.'],
-            ['s1', 'a.1', '1', '1', '1000', '+', '2', 'a.1.exon.2', '110', '200', '150', '200', '.', '0'],
-            ['s1', 'a.1', '1', '1', '1000', '+', '3', 'a.1.exon.3', '300', '400', '300', '400', '0', '2'],
-            ['s1', 'a.1', '1', '1', '1000', '+', '4', 'a.1.exon.4', '600', '900', '600', '603', '2', '.'],
-            ['s1', 'a.1', '1', '1', '1000', '+', '5', 'a.1.exon.5', '910', '930', '.', '.', '.', '.']
+        self.good = [r[:] for r in GOOD]
+        self.good_output = GOOD_OUTPUT[:]
+        self.minus = [r[:] for r in MINUS]
+        self.minus_output = MINUS_OUTPUT[:]
+
+    def test_good(self):
+        self.assertEqual(readgff(self.good), self.good_output)
+
+    def test_minus(self):
+        self.assertEqual(readgff(self.minus), self.minus_output)
+
+    def test_wanted(self):
+        self.assertEqual(readgff(self.good, wanted={'a.1'}), self.good_output)
+        self.assertEqual(readgff(self.good, wanted={'b.1'}), [])
+        self.assertEqual(readgff(self.good, wanted=set()), [])
+
+    def test_wanted_skips_unwanted_genes(self):
+        # The malformed gene 'b' is never built, so raises no warning
+        gff = prepare_gff(self.good + [
+            ['s1', '.', 'gene', '2000', '3000', '.', '+', '.', 'ID=b'],
+            ['s1', '.', 'mRNA', '2000', '3001', '.', '+', '.', 'ID=b.1'],
+            ['s1', '.', 'gene', '4000', '5000', '.', '+', '.', 'ID=c'],
+            ['s1', '.', 'mRNA', '4000', '5000', '.', '+', '.', 'ID=c.1'],
+            ['s1', '.', 'mRNA', '4000', '5000', '.', '+', '.', 'ID=c.2']
+        ])
+        errout = io.StringIO()
+        genes = list(gffreader.gff_reader(gff, errout=errout, wanted={'a.1', 'c.2'}))
+        self.assertEqual([g.ident for g in genes], ['a', 'c'])
+        self.assertEqual([m.ident for m in genes[1].mRNAs], ['c.1', 'c.2'])
+        self.assertEqual(errout.getvalue(), '')
+
+    def test_unstranded(self):
+        # phased like "-", but the strand is written as given
+        gff = [r[:6] + ['.'] + r[7:] for r in self.good[0:2] + self.good[3:5]]
+        self.assertEqual(readgff(gff), ['s1 a.1 1 1 1000 . 1 a.1.exon.2 110 200 150 200 0 .'])
+
+    def test_malformed(self):
+        bad = [
+            # mRNA outside gene
+            ['s1', '.', 'gene', '2000', '3000', '.', '+', '.', 'ID=b'],
+            ['s1', '.', 'mRNA', '1999', '3000', '.', '+', '.', 'ID=b.1'],
+            ['s1', '.', 'exon', '2100', '2200', '.', '+', '.', 'ID=b.1.e1'],
+            # exons out of order
+            ['s1', '.', 'gene', '4000', '5000', '.', '+', '.', 'ID=c'],
+            ['s1', '.', 'mRNA', '4000', '5000', '.', '+', '.', 'ID=c.1'],
+            ['s1', '.', 'exon', '4300', '4400', '.', '+', '.', 'ID=c.1.e2'],
+            ['s1', '.', 'exon', '4100', '4200', '.', '+', '.', 'ID=c.1.e1'],
+            # CDS outside its exon
+            ['s1', '.', 'gene', '6000', '7000', '.', '+', '.', 'ID=d'],
+            ['s1', '.', 'mRNA', '6000', '7000', '.', '+', '.', 'ID=d.1'],
+            ['s1', '.', 'exon', '6100', '6200', '.', '+', '.', 'ID=d.1.e1'],
+            ['s1', '.', 'CDS', '6150', '6250', '.', '+', '.', 'ID=d.1.c1'],
+            # wrong strand
+            ['s1', '.', 'gene', '8000', '9000', '.', '+', '.', 'ID=e'],
+            ['s1', '.', 'mRNA', '8000', '9000', '.', '-', '.', 'ID=e.1']
         ]
-        self.good_output = [' '.join(s) for s in self.good_output]
+        gff = self.good + bad + self.minus
+        self.assertEqual(readgff(gff), self.good_output + self.minus_output)
+        errout = io.StringIO()
+        list(gffreader.gff_reader(prepare_gff(gff), errout=errout))
+        for category in ('outside-gene', 'exon-order', 'CDS-outside-exon', 'strand-mismatch'):
+            self.assertTrue('  %s: 1' % category in errout.getvalue())
 
-        self.minus = [
+class Test_gff_assembler(unittest.TestCase):
+    def setUp(self):
+        self.unordered = [
+            ['s2', '.', 'exon', '5110', '5200', '.', '+', '.', 'ID=b.1.e2;Parent=b.1'],
+            ['s1', '.', 'CDS',  '400', '500',  '.', '-', '.', 'ID=a.1.cds.2;Parent=a.1'],
+            ['s1', '.', 'exon', '200', '300',  '.', '-', '.', 'ID=a.1.exon.4;Parent=a.1'],
+            ['s2', '.', 'CDS',  '5150', '5200', '.', '+', '.', 'ID=b.1.c1;Parent=b.1'],
+            ['s1', '.', 'exon', '10',  '150',  '.', '-', '.', 'ID=a.1.exon.5;Parent=a.1'],
+            ['s1', '.', 'mRNA', '1',   '1000', '.', '-', '.', 'ID=a.1;Parent=a'],
+            ['s1', '.', 'exon', '600', '700',  '.', '-', '.', 'ID=a.1.exon.2;Parent=a.1'],
+            ['s2', '.', 'mRNA', '5001', '6000', '.', '+', '.', 'ID=b.1;Parent=b'],
+            ['s1', '.', 'CDS',  '297', '300',  '.', '-', '.', 'ID=a.1.cds.3;Parent=a.1'],
+            ['s1', '.', 'exon', '800', '900',  '.', '-', '.', 'ID=a.1.exon.1;Parent=a.1'],
+            ['s2', '.', 'exon', '5100', '5109', '.', '+', '.', 'ID=b.1.e1;Parent=b.1'],
+            ['s1', '.', 'CDS',  '600', '650',  '.', '-', '.', 'ID=a.1.cds.1;Parent=a.1'],
             ['s1', '.', 'gene', '1',   '1000', '.', '-', '.', 'ID=a'],
-            ['s1', '.', 'mRNA', '1',   '1000', '.', '-', '.', 'ID=a.1'],
-            ['s1', '.', 'exon', '800', '900',  '.', '-', '.', 'ID=a.1.exon.1'],
-            ['s1', '.', 'exon', '600', '700',  '.', '-', '.', 'ID=a.1.exon.2'],
-            ['s1', '.', 'CDS',  '600', '650',  '.', '-', '.', 'ID=a.1.cds.1'],
-            ['s1', '.', 'exon', '400', '500',  '.', '-', '.', 'ID=a.1.exon.3'],
-            ['s1', '.', 'CDS',  '400', '500',  '.', '-', '.', 'ID=a.1.cds.2'],
-            ['s1', '.', 'exon', '200', '300',  '.', '-', '.', 'ID=a.1.exon.4'],
-            ['s1', '.', 'CDS',  '297', '300',  '.', '-', '.', 'ID=a.1.cds.2'],
-            ['s1', '.', 'exon', '10',  '150',  '.', '-', '.', 'ID=a.1.exon.5']
+            ['s1', '.', 'exon', '400', '500',  '.', '-', '.', 'ID=a.1.exon.3;Parent=a.1'],
+            ['s2', '.', 'gene', '5001', '6000', '.', '+', '.', 'ID=b']
         ]
-        self.minus_output = [
+        self.unordered_output = [
             ['s1', 'a.1', '1', '1', '1000', '-', '1', 'a.1.exon.1', '800', '900',   '.',   '.', '.', '.'],
             ['s1', 'a.1', '1', '1', '1000', '-', '2', 'a.1.exon.2', '600', '700', '600', '650', '.', '0'],
             ['s1', 'a.1', '1', '1', '1000', '-', '3', 'a.1.exon.3', '400', '500', '400', '500', '0', '2'],
             ['s1', 'a.1', '1', '1', '1000', '-', '4', 'a.1.exon.4', '200', '300', '297', '300', '2', '.'],
-            ['s1', 'a.1', '1', '1', '1000', '-', '5', 'a.1.exon.5', '10',  '150',   '.',   '.', '.', '.']
+            ['s1', 'a.1', '1', '1', '1000', '-', '5', 'a.1.exon.5', '10',  '150',   '.',   '.', '.', '.'],
+            ['s2', 'b.1', '1', '5001', '6000', '+', '1', 'b.1.e1', '5100', '5109', '.', '.', '.', '.'],
+            ['s2', 'b.1', '1', '5001', '6000', '+', '2', 'b.1.e2', '5110', '5200', '5150', '5200', '.', '0']
         ]
-        self.minus_output = [' '.join(s) for s in self.minus_output]
+        self.unordered_output = [' '.join(s) for s in self.unordered_output]
 
-    def test_good(self):
-        self.assertEqual(readgff(self.good), self.good_output)
+    def test_unordered(self):
+        self.assertEqual(readgff(self.unordered, reader=gffreader.gff_assembler),
+                         self.unordered_output)
 
-    def test_minus(self):
-        self.assertEqual(readgff(self.minus), self.minus_output)
+    def test_shuffled_tids(self):
+        gff = [
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1;Parent=a'],
+            ['s1', '.', 'exon', '100', '200', '.', '+', '.', 'ID=a.1.e1;Parent=a.1'],
+            ['s1', '.', 'CDS', '150', '200', '.', '+', '.', 'ID=a.1.c1;Parent=a.1'],
+            ['s1', '.', 'mRNA', '50', '900', '.', '+', '.', 'ID=a.2;Parent=a'],
+            ['s1', '.', 'exon', '100', '200', '.', '+', '.', 'ID=a.2.e1;Parent=a.2'],
+            ['s1', '.', 'mRNA', '50', '900', '.', '+', '.', 'ID=a.3;Parent=a'],
+            ['s1', '.', 'exon', '300', '400', '.', '+', '.', 'ID=a.3.e1;Parent=a.3'],
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=b'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=b.1;Parent=b'],
+            ['s1', '.', 'exon', '100', '200', '.', '+', '.', 'ID=b.1.e1;Parent=b.1']
+        ]
+        expected = readgff(gff, reader=gffreader.gff_assembler)
+        self.assertEqual([l.split()[1:3] for l in expected],
+                         [['a.1', '1'], ['a.2', '2'], ['a.3', '3'], ['b.1', '1']])
+        rng = random.Random(4)
+        for _ in range(20):
+            rng.shuffle(gff)
+            self.assertEqual(readgff(gff, reader=gffreader.gff_assembler), expected)
+
+    def test_shuffled_seqids(self):
+        rng = random.Random(8)
+        gff = self.unordered[:]
+        for _ in range(10):
+            rng.shuffle(gff)
+            self.assertEqual(readgff(gff, reader=gffreader.gff_assembler),
+                             self.unordered_output)
+
+    def test_unstranded_exon_order(self):
+        # without a strand, exons are read 3' to 5' as on "-"
+        gff = [
+            ['s1', '.', 'gene', '1', '1000', '.', '.', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '.', '.', 'ID=a.1;Parent=a'],
+            ['s1', '.', 'exon', '600', '700', '.', '.', '.', 'ID=a.1.e2;Parent=a.1'],
+            ['s1', '.', 'exon', '100', '200', '.', '.', '.', 'ID=a.1.e1;Parent=a.1']
+        ]
+        expected = readgff(gff)
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(readgff(gff[::-1], reader=gffreader.gff_assembler), expected)
+
+    def test_spilled_partitions(self):
+        self.assertEqual(readgff(self.unordered, reader=gffreader.gff_assembler, maxlines=2),
+                         self.unordered_output)
+
+    def test_wanted(self):
+        self.assertEqual(readgff(self.unordered, reader=gffreader.gff_assembler, wanted={'a.1'}),
+                         self.unordered_output[:5])
+
+    def test_orphan_children(self):
+        test = [
+            ['s1', '.', 'exon', '100', '200', '.', '+', '.', 'ID=a.1.exon.1;Parent=a.1'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1;Parent=x']
+        ]
+        self.assertEqual(readgff(test, reader=gffreader.gff_assembler), [])
+
+    def test_cds_outside_exon(self):
+        test = [
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'CDS',  '30', '131',  '.', '+', '.', 'ID=a.1.cds.1;Parent=a.1'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1;Parent=a'],
+            ['s1', '.', 'exon', '100', '200', '.', '+', '.', 'ID=a.1.exon.1;Parent=a.1']
+        ]
+        self.assertEqual(readgff(test, reader=gffreader.gff_assembler), [])
+
+    def test_overlapping_exons(self):
+        test = [
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1;Parent=a'],
+            ['s1', '.', 'exon', '150', '300', '.', '+', '.', 'ID=a.1.exon.2;Parent=a.1'],
+            ['s1', '.', 'exon', '100', '200', '.', '+', '.', 'ID=a.1.exon.1;Parent=a.1']
+        ]
+        self.assertEqual(readgff(test, reader=gffreader.gff_assembler), [])
+
+class Test_engine(unittest.TestCase):
+    def test_run_batches(self):
+        items = list(range(103))
+        for threads in (1, 2, 8):
+            out = engine.run_batches(lambda b: [x * 2 for x in b], items, threads, batchsize=10)
+            self.assertEqual(sum(out, []), [x * 2 for x in items])
+
+    def test_threaded_exonstat(self):
+        gff = GOOD + MINUS
+        self.assertEqual(list(pedpha.threaded_exonstat(prepare_gff(gff), 2, batchsize=1)),
+                         GOOD_OUTPUT + MINUS_OUTPUT)
+
+    def test_usable_threads(self):
+        self.assertEqual(engine.usable_threads(4), 1 if engine.gil_enabled() else 4)
 
 class Test_phase(unittest.TestCase):
     def test_same_interval_0_offset(self):
@@ -261,6 +467,61 @@ class Test_format_checkint(unittest.TestCase):
         ]
         self.assertEqual(readgff(test), [])
 
+    def test_diagnostics_summary(self):
+        bad = []
+        for i in range(20):
+            bad += [
+                ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=b%d' % i],
+                ['s1', '.', 'mRNA', '1', '1000', '.', '-', '.', 'ID=b%d.1' % i]
+            ]
+        bad += [['s1', '.', 'mRNA', '1', '1000', '.', '-', '.', 'a.1']]
+        errout, detail = io.StringIO(), io.StringIO()
+        fc = gffreader.FormatChecker(errout, max_examples=2, detail=detail)
+        diagnostics = fc.diagnostics
+        g = gffreader.Gene('b', 's1', [1, 1000], '+')
+        for row in bad:
+            line = '\t'.join(row)
+            d = gffreader.line2gffdict(line)
+            fc.check_gene_element(g, d, gffreader.parse_desc(d['desc']), line)
+        self.assertEqual(errout.getvalue(), '')
+        self.assertEqual(diagnostics.counts, {'strand-mismatch': 21, 'missing-id': 1})
+        self.assertEqual(len(diagnostics.examples['strand-mismatch']), 2)
+        self.assertEqual(len(detail.getvalue().splitlines()), 22)
+        fc.report()
+        report = errout.getvalue().splitlines()
+        self.assertEqual(report[1], '  strand-mismatch: 21')
+        self.assertEqual(report[6], '    ... and 19 more')
+        self.assertEqual(report[7], '  missing-id: 1')
+
+    def test_diagnostics_reported_once(self):
+        test = [
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1001', '.', '+', '.', 'ID=a.1'],
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=b'],
+            ['s1', '.', 'mRNA', '1', '1001', '.', '+', '.', 'ID=b.1']
+        ]
+        errout = io.StringIO()
+        genes = gffreader.gff_reader(prepare_gff(test), errout=errout)
+        self.assertEqual(list(genes), [])
+        self.assertEqual(errout.getvalue().count('outside-gene: 2'), 1)
+
+    def test_diagnostics_options(self):
+        test = [
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1001', '.', '+', '.', 'ID=a.1'],
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=b'],
+            ['s1', '.', 'mRNA', '1', '1001', '.', '+', '.', 'ID=b.1']
+        ]
+        for reader in (gffreader.gff_reader, gffreader.gff_assembler):
+            errout, detail = io.StringIO(), io.StringIO()
+            list(reader(prepare_gff(test), errout=errout, max_examples=0, detail=detail))
+            self.assertTrue('    ... and 2 more' in errout.getvalue())
+            self.assertEqual(len(detail.getvalue().splitlines()), 2)
+        # the options are not shared between readers
+        errout = io.StringIO()
+        list(gffreader.gff_reader(prepare_gff(test), errout=errout))
+        self.assertFalse('more' in errout.getvalue())
+
     def test_no_cds_ident(self):
         test = [
             ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
@@ -275,10 +536,10 @@ class Test_format_checkint(unittest.TestCase):
 # pedpha tests
 # ============
 
-def ready_phaser(gfflist, intervals):
+def ready_phaser(gfflist, intervals, **kwargs):
     gff = prepare_gff(gfflist)
     intervals = [s + "\n" for s in intervals]
-    out = list(pedpha.phaser(gff, intervals))
+    out = list(pedpha.phaser(gff, intervals, **kwargs))
     return(out)
 
 
@@ -390,6 +651,72 @@ class Test_phaser(unittest.TestCase):
                          [('a.1', 2, 'z', 1, '-', 600, 700, 600, 647, 4, 51, ".-0"),
                           ('a.1', 3, 'z', 1, '-', 400, 500, 498, 500, 52, 54, "0-2")])
 
+    def test_coalesce(self):
+        rng = random.Random(7)
+        for gff in (self.gff, self.minus, self.multigene):
+            intervals = []
+            for i in range(40):
+                start = rng.randint(1, 60)
+                stop = start + rng.randint(0, 20)
+                mrna = rng.choice(['a.1', 'b.1', 'b.2'])
+                intervals.append('%s d%d %d %d' % (mrna, i % 5, start, stop))
+            intervals += intervals[:10]
+            expected = ready_phaser(gff, intervals)
+            self.assertTrue(expected)
+            for mode in ('dedup', 'merge'):
+                self.assertEqual(ready_phaser(gff, intervals, coalesce=mode), expected)
+
+    def test_coalesce_bounds(self):
+        bounds = [(10, 20), (1, 5), (15, 30), (10, 20), (31, 40)]
+        self.assertEqual(pedpha.coalesce_bounds(bounds),
+                         {(1, 5): (1, 5), (10, 20): (10, 20), (15, 30): (15, 30), (31, 40): (31, 40)})
+        self.assertEqual(pedpha.coalesce_bounds(bounds, merge=True),
+                         {(1, 5): (1, 5), (10, 20): (10, 30), (15, 30): (10, 30), (31, 40): (31, 40)})
+
+    def test_batches(self):
+        gff = prepare_gff(self.multigene)
+        intervals = ["a.1 z 1 18\n", "b.1 z 1 2\n", "b.2 y 1 18\n", "b.1 z 3 4\n"]
+        expected = list(pedpha.phaser(prepare_gff(self.multigene), intervals))
+        batches = list(pedpha.phaser_batches(gff, intervals, size=2))
+        self.assertEqual([len(b) for b in batches], [2, 2, 2])
+        self.assertEqual(sum((b.rows() for b in batches), []), expected)
+        self.assertEqual(batches[0].dictionaries['mrna'].values, ['a.1', 'b.1', 'b.2'])
+        self.assertEqual(list(batches[1].columns['mrna']), [1, 1])
+        self.assertEqual(list(batches[1].columns['start']), [5150, 5156])
+        batches = pedpha.phaser_batches(prepare_gff(self.multigene), intervals, size=4)
+        self.assertEqual([len(b) for b in batches], [4, 2])
+        # same columns and codes as batching the phaser row tuples
+        rows = columnar.batches(expected, pedpha.PHASER_COLUMNS, ('mrna', 'domain', 'strand', 'phase'), 4)
+        batches = pedpha.phaser_batches(prepare_gff(self.multigene), intervals, size=4)
+        self.assertEqual([b.columns for b in batches], [b.columns for b in rows])
+
+    def test_threaded(self):
+        rng = random.Random(11)
+        intervals = ['%s d%d %d %d' % (rng.choice(['a.1', 'b.1', 'b.2']), i, s, s + rng.randint(0, 15))
+                     for i, s in enumerate(rng.randint(1, 50) for _ in range(60))]
+        intervals = [s + "\n" for s in intervals]
+        expected = [pedpha.ROW_FORMAT % row for row in pedpha.phaser(prepare_gff(self.multigene), intervals)]
+        for threads, batchsize in ((1, 1), (4, 1), (3, 2)):
+            out = pedpha.threaded_phaser(prepare_gff(self.multigene), intervals, threads, batchsize=batchsize)
+            self.assertEqual(list(out), expected)
+
+    def test_intervals_not_mutated(self):
+        inter = pedpha.Intervals(["a.1 z 1 18\n"])
+        for gene in gffreader.gff_reader(prepare_gff(self.gff)):
+            for mrna in gene.mRNAs:
+                self.assertEqual(len(list(pedpha.map_mrna(gene, mrna, inter))), 2)
+                self.assertEqual(len(list(pedpha.map_mrna(gene, mrna, inter))), 2)
+        self.assertEqual(list(inter.get_bounds('a.1')), [('z', (1, 54))])
+
+    def test_unmapped_mRNA_not_phased(self):
+        gff = prepare_gff(self.multigene)
+        inter = pedpha.Intervals(["b.1 z 1 2\n"])
+        for gene in gffreader.gff_reader(gff):
+            for mrna in gene.mRNAs:
+                list(pedpha.map_mrna(gene, mrna, inter))
+                phased = [e.phase for e in mrna.exons if e.CDS] != [('.', '.')] * 3
+                self.assertEqual(phased, mrna.ident == 'b.1')
+
     def test_bad_interval(self):
         self.assertRaises(SystemExit, pedpha.Intervals, ["a.1 z 0   1\n"])
         self.assertRaises(SystemExit, pedpha.Intervals, ["a.1 z 1   0\n"])
@@ -397,6 +724,396 @@ class Test_phaser(unittest.TestCase):
         self.assertRaises(SystemExit, pedpha.Intervals, ["a.1 z -1  1\n"])
         self.assertRaises(SystemExit, pedpha.Intervals, ["a.1 z a   1\n"])
 
+# ===========
+# fasta tests
+# ===========
+
+class Test_fasta(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.seqs = {
+            's1': ''.join(rng.choice('ACGT') for _ in range(1000)),
+            's2': ''.join(rng.choice('ACGT') for _ in range(95))
+        }
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'genome.fa')
+        with open(self.path, 'w') as f:
+            for name, seq in sorted(self.seqs.items()):
+                fasta.write_fasta(name + ' description', seq, out=f, width=17)
+        self.genome = fasta.IndexedFasta(self.path)
+
+    def tearDown(self):
+        self.genome.close()
+        self.tmpdir.cleanup()
+
+    def test_index(self):
+        self.assertTrue(os.path.exists(self.path + '.fai'))
+        self.assertEqual(self.genome.index['s1'], (1000, 16, 17, 18))
+        self.assertEqual(self.genome.index['s2'][0], 95)
+
+    def test_fetch(self):
+        for name, seq in self.seqs.items():
+            for start, stop in ((1, 1), (1, 17), (17, 18), (30, 80), (2, len(seq))):
+                self.assertEqual(self.genome.fetch(name, start, stop), seq[start-1:stop])
+
+    def test_fetch_minus(self):
+        self.assertEqual(self.genome.fetch('s1', 10, 40, '-'),
+                         fasta.revcomp(self.seqs['s1'][9:40]))
+
+    def test_fetch_out_of_range(self):
+        self.assertRaises(SystemExit, self.genome.fetch, 's2', 90, 96)
+        self.assertRaises(SystemExit, self.genome.fetch, 's3', 1, 2)
+
+    def test_revcomp(self):
+        self.assertEqual(fasta.revcomp('AACGTn'), 'nACGTT')
+
+    def test_translate(self):
+        self.assertEqual(fasta.translate('ATGGCCTAAGN'), 'MA*')
+        self.assertEqual(fasta.translate('ATGNNN'), 'MX')
+
+    def test_sequencer(self):
+        gff = prepare_gff([
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1'],
+            ['s1', '.', 'exon', '110', '200', '.', '+', '.', 'ID=a.1.e1'],
+            ['s1', '.', 'CDS', '150', '200', '.', '+', '.', 'ID=a.1.c1'],
+            ['s1', '.', 'exon', '300', '400', '.', '+', '.', 'ID=a.1.e2'],
+            ['s1', '.', 'CDS', '300', '400', '.', '+', '.', 'ID=a.1.c2']
+        ])
+        s1 = self.seqs['s1']
+        out = list(pedpha.sequencer(gff, ["a.1 z 1 18\n"], self.genome))
+        self.assertEqual(out, [('a.1|z|1', s1[149:200] + s1[299:302])])
+
+    def test_sequencer_minus(self):
+        gff = prepare_gff([
+            ['s1', '.', 'gene', '1',   '1000', '.', '-', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1',   '1000', '.', '-', '.', 'ID=a.1'],
+            ['s1', '.', 'exon', '600', '700',  '.', '-', '.', 'ID=a.1.exon.1'],
+            ['s1', '.', 'CDS',  '600', '650',  '.', '-', '.', 'ID=a.1.cds.1'],
+            ['s1', '.', 'exon', '400', '500',  '.', '-', '.', 'ID=a.1.exon.2'],
+            ['s1', '.', 'CDS',  '400', '500',  '.', '-', '.', 'ID=a.1.cds.2']
+        ])
+        s1 = self.seqs['s1']
+        out = list(pedpha.sequencer(gff, ["a.1 z 2 18\n"], self.genome, translate=True))
+        cds = fasta.revcomp(s1[599:647]) + fasta.revcomp(s1[497:500])
+        self.assertEqual(out, [('a.1|z|1', fasta.translate(cds))])
+
+    def test_cli_output(self):
+        gff = os.path.join(self.tmpdir.name, 'a.gff')
+        intervals = os.path.join(self.tmpdir.name, 'a.int')
+        output = os.path.join(self.tmpdir.name, 'seq.fa')
+        with open(gff, 'w') as f:
+            f.writelines(prepare_gff(GOOD))
+        with open(intervals, 'w') as f:
+            print('a.1 z 1 18', file=f)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pedpha.py')
+        proc = subprocess.run([sys.executable, script, '-g', gff, '-i', intervals,
+                               '-G', self.path, '-o', output],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(proc.stdout, '')
+        s1 = self.seqs['s1']
+        with open(output) as f:
+            self.assertEqual(f.read(), '>a.1|z|1\n' + s1[149:200] + s1[299:302] + '\n')
+
+# =============
+# extsort tests
+# =============
+
+class Test_extsort(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        self.records = []
+        for i in range(500):
+            start = rng.randint(1, 10000)
+            self.records.append((rng.choice(['chr1', 'chr2', 'chr10']),
+                                 start, start + rng.randint(0, 300), 'r%d' % i))
+        self.expected = sorted(self.records, key=lambda r: r[0:3])
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def sort(self, memory):
+        sorter = extsort.ExternalSorter(memory=memory)
+        for record in self.records:
+            sorter.add(*record)
+        return(sorter)
+
+    def test_in_memory(self):
+        sorter = self.sort(memory=2**30)
+        self.assertEqual(sorter.runs, [])
+        self.assertEqual(list(sorter), self.expected)
+
+    def test_spilled_runs(self):
+        sorter = self.sort(memory=5000)
+        self.assertTrue(len(sorter.runs) > 10)
+        self.assertEqual(list(sorter), self.expected)
+
+    def test_index_query(self):
+        path = os.path.join(self.tmpdir.name, 'sorted.txt')
+        index = path + '.idx'
+        with open(path, 'w') as out, open(index, 'w') as indexout:
+            extsort.write_sorted(self.sort(memory=5000), out, indexout, blocksize=16)
+        self.assertTrue(len(extsort.read_index(index)) > 20)
+        for seqid, start, stop in (('chr1', 1, 10000), ('chr2', 500, 900), ('chr10', 4000, 4000), ('chr3', 1, 100)):
+            expected = ['%s %d %d %s' % r for r in self.expected
+                        if r[0] == seqid and r[1] <= stop and r[2] >= start]
+            self.assertEqual(list(extsort.query(path, index, seqid, start, stop)), expected)
+
+    def test_sorted_phaser(self):
+        gff = prepare_gff([
+            ['s2', '.', 'gene', '5001', '6000', '.', '+', '.', 'ID=b'],
+            ['s2', '.', 'mRNA', '5001', '6000', '.', '+', '.', 'ID=b.1'],
+            ['s2', '.', 'exon', '5110', '5200', '.', '+', '.', 'ID=b.1.e1'],
+            ['s2', '.', 'CDS', '5150', '5200', '.', '+', '.', 'ID=b.1.c1'],
+            ['s2', '.', 'exon', '5300', '5400', '.', '+', '.', 'ID=b.1.e2'],
+            ['s2', '.', 'CDS', '5300', '5400', '.', '+', '.', 'ID=b.1.c2'],
+            ['s1', '.', 'gene', '1', '1000', '.', '+', '.', 'ID=a'],
+            ['s1', '.', 'mRNA', '1', '1000', '.', '+', '.', 'ID=a.1'],
+            ['s1', '.', 'exon', '110', '200', '.', '+', '.', 'ID=a.1.e1'],
+            ['s1', '.', 'CDS', '150', '200', '.', '+', '.', 'ID=a.1.c1']
+        ])
+        out = list(pedpha.sorted_phaser(gff, ["b.1 y 1 20\n", "b.1 z 1 2\n", "a.1 z 3 4\n"]))
+        self.assertEqual(out, [
+            ('s1', 156, 161, 'a.1 1 z 1 + 110 200 7 12 .-0'),
+            ('s2', 5150, 5155, 'b.1 1 z 1 + 5110 5200 1 6 .-0'),
+            ('s2', 5150, 5200, 'b.1 1 y 1 + 5110 5200 1 51 .-0'),
+            ('s2', 5300, 5308, 'b.1 2 y 1 + 5300 5400 52 60 0-2')
+        ])
+
+    def test_sort_memory_option(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            for mb in ('0', '-1'):
+                self.assertRaises(SystemExit, pedpha.parse, ['--sort-memory', mb])
+        self.assertEqual(pedpha.parse(['--sort-memory', '64']).sort_memory, 64)
+
+# ================
+# checkpoint tests
+# ================
+
+class Test_checkpoint(unittest.TestCase):
+    def setUp(self):
+        gff = make_genes("-+-+-+-")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gff = self.path('a.gff')
+        self.intervals = self.path('intervals.txt')
+        with open(self.gff, 'w') as f:
+            f.writelines(prepare_gff(gff))
+        with open(self.intervals, 'w') as f:
+            for i in range(0, 7, 2):
+                print('g%d.1 z 1 18' % i, file=f)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return(os.path.join(self.tmpdir.name, name))
+
+    def run_pedpha(self, *argv):
+        argv = ['-g', self.gff, '--checkpoint', self.path('cp.json')] + list(argv)
+        args = pedpha.parse(argv)
+        try:
+            pedpha.run_checkpointed(args)
+        finally:
+            args.gff.close()
+            if args.intervals:
+                args.intervals.close()
+        with open(args.output) as f:
+            return(f.read())
+
+    def interrupt(self, blocks, ngenes, *argv):
+        # checkpoint as a run of pedpha with the options in argv would
+        args = pedpha.parse(['-g', self.gff] + list(argv))
+        run = pedpha.checkpoint_run(args)
+        args.gff.close()
+        if args.intervals:
+            args.intervals.close()
+        cp = checkpoint.Checkpoint(self.path('cp.json'), every=2, run=run)
+        gff, out = cp.open(self.gff, self.path('out.txt'))
+        checkpoint.write_checkpointed(itertools.islice(blocks(gff), ngenes), out, cp)
+        # output written after the last checkpoint, before being killed
+        print('partial line', file=out)
+        out.close()
+        gff.close()
+
+    def test_resume_exonstat(self):
+        expected = self.run_pedpha('-o', self.path('full.txt'))
+        self.assertEqual(len(expected.splitlines()), 35)
+        for ngenes in (1, 3, 4, 6):
+            self.interrupt(lambda gff: ((g, g.tostr()) for g in gffreader.gff_reader(gff)), ngenes)
+            state = checkpoint.Checkpoint(self.path('cp.json')).load()
+            self.assertEqual(state['gene'], 'g%d' % (ngenes - 1))
+            self.assertEqual(self.run_pedpha('-o', self.path('out.txt'), '--resume'), expected)
+
+    def test_resume_phaser(self):
+        expected = self.run_pedpha('-i', self.intervals, '-o', self.path('full.txt'))
+        self.assertEqual(len(expected.splitlines()), 8)
+        for ngenes in (1, 2, 3):
+            with open(self.intervals) as intervals:
+                self.interrupt(lambda gff: pedpha.phaser_blocks(gff, intervals), ngenes,
+                               '-i', self.intervals)
+            resumed = self.run_pedpha('-i', self.intervals, '-o', self.path('out.txt'), '--resume')
+            self.assertEqual(resumed, expected)
+
+    def test_resume_without_checkpoint(self):
+        expected = self.run_pedpha('-o', self.path('full.txt'))
+        os.remove(self.path('cp.json'))
+        self.assertEqual(self.run_pedpha('-o', self.path('out.txt'), '--resume'), expected)
+
+    def assertCannotResume(self, *argv):
+        with self.assertRaises(SystemExit) as cm:
+            self.run_pedpha('-o', self.path('out.txt'), '--resume', *argv)
+        self.assertTrue('resume' in str(cm.exception.code))
+
+    def test_resume_other_run(self):
+        exonstat = lambda gff: ((g, g.tostr()) for g in gffreader.gff_reader(gff))
+        self.interrupt(exonstat, 3)
+        with open(self.intervals) as intervals:
+            self.interrupt(lambda gff: pedpha.phaser_blocks(gff, intervals), 2,
+                           '-i', self.intervals)
+        # different options
+        self.assertCannotResume()
+        self.assertCannotResume('-i', self.intervals, '--coalesce', 'merge')
+        # different GFF
+        self.interrupt(exonstat, 3)
+        with open(self.gff, 'a') as f:
+            f.writelines(prepare_gff(make_genes("+", prefix='h')))
+        self.assertCannotResume()
+        # GFF rewritten with the same size
+        self.interrupt(exonstat, 3)
+        stat = os.stat(self.gff)
+        os.utime(self.gff, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertCannotResume()
+        # interval file rewritten with the same size
+        with open(self.intervals) as intervals:
+            self.interrupt(lambda gff: pedpha.phaser_blocks(gff, intervals), 2,
+                           '-i', self.intervals)
+        with open(self.intervals) as f:
+            text = f.read()
+        with open(self.intervals, 'w') as f:
+            f.write(text.replace('1 18', '1 17'))
+        self.assertCannotResume('-i', self.intervals)
+
+    def test_resume_missing_output(self):
+        self.interrupt(lambda gff: ((g, g.tostr()) for g in gffreader.gff_reader(gff)), 3)
+        os.remove(self.path('out.txt'))
+        self.assertCannotResume()
+
+    def test_unsupported_options(self):
+        for argv in (['-j', '2'], ['--sample', '2']):
+            with self.assertRaises(SystemExit):
+                self.run_pedpha('-o', self.path('out.txt'), *argv)
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, self.run_pedpha, '-o', self.path('out.txt'),
+                              '--checkpoint-every', '0')
+
+# ==============
+# sampling tests
+# ==============
+
+class Test_sampling(unittest.TestCase):
+    def setUp(self):
+        gff = [['s1', '.', 'contig', '1', '10000', '.', '+', '.', 'ID=s1']]
+        gff += make_genes("-++-++-++-")
+        self.lines = prepare_gff(gff)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gff = os.path.join(self.tmpdir.name, 'a.gff')
+        with open(self.gff, 'w') as f:
+            f.writelines(self.lines)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def gene_idents(self, blocks):
+        return([gffreader.parse_desc(b[0].rstrip().split('\t')[8]) for b in blocks])
+
+    def test_reservoir_all(self):
+        blocks, n = sampling.reservoir_sample(self.lines, 20, random.Random(1))
+        self.assertEqual(n, 10)
+        self.assertEqual(list(itertools.chain.from_iterable(blocks)), self.lines[1:])
+
+    def test_reservoir_uniform(self):
+        rng = random.Random(5)
+        counts = collections.Counter()
+        for _ in range(3000):
+            blocks, n = sampling.reservoir_sample(self.lines, 3, rng)
+            idents = self.gene_idents(blocks)
+            self.assertEqual(len(idents), 3)
+            self.assertEqual(idents, sorted(idents, key=lambda x: int(x[1:])))
+            counts.update(idents)
+        for ident in counts:
+            self.assertTrue(800 < counts[ident] < 1000)
+
+    def test_gene_index(self):
+        index = os.path.join(self.tmpdir.name, 'a.gidx')
+        with open(self.gff) as gff:
+            first, n = pedpha.sample_genes(gff, 4, seed=2, gene_index=index)
+        stamp, offsets = sampling.read_gene_index(index)
+        self.assertEqual(stamp, sampling.gff_stamp(self.gff))
+        self.assertEqual(len(offsets), 10)
+        with open(self.gff, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                self.assertEqual(f.readline().split(b'\t')[2], b'gene')
+        with open(self.gff) as gff:
+            blocks, n = pedpha.sample_genes(gff, 4, seed=2, gene_index=index)
+        self.assertEqual(n, 10)
+        self.assertEqual(len(blocks), 4)
+        self.assertTrue(all(b[-1].endswith('\n') for b in blocks))
+        # the run that builds the index draws the same sample as later runs
+        self.assertEqual(blocks, first)
+        for seed in range(5):
+            os.remove(index)
+            samples = []
+            for _ in range(2):
+                with open(self.gff) as gff:
+                    samples.append(pedpha.sample_stats(gff, 3, seed=seed, gene_index=index))
+            self.assertEqual(samples[0], samples[1])
+        with open(self.gff) as gff:
+            blocks, n = pedpha.sample_genes(gff, 10, gene_index=index)
+        self.assertEqual(list(itertools.chain.from_iterable(blocks)), self.lines[1:])
+
+    def test_stale_gene_index(self):
+        index = os.path.join(self.tmpdir.name, 'a.gidx')
+        with open(self.gff) as gff:
+            pedpha.sample_genes(gff, 4, gene_index=index)
+        # the GFF changes after the index is built
+        with open(self.gff, 'w') as f:
+            f.writelines(self.lines[0:1] + prepare_gff(make_genes("+-+", prefix='h')))
+        errout = io.StringIO()
+        with open(self.gff) as gff, contextlib.redirect_stderr(errout):
+            blocks, n = pedpha.sample_genes(gff, 10, gene_index=index)
+        self.assertTrue('does not match the GFF' in errout.getvalue())
+        self.assertEqual(n, 3)
+        self.assertEqual(self.gene_idents(blocks), ['h0', 'h1', 'h2'])
+        stamp, offsets = sampling.read_gene_index(index)
+        self.assertEqual(stamp, sampling.gff_stamp(self.gff))
+        self.assertEqual(len(offsets), 3)
+
+    def test_sample_options(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            for k in ('0', '-2'):
+                self.assertRaises(SystemExit, pedpha.parse, ['--sample', k])
+        self.assertEqual(pedpha.parse(['--sample', '3']).sample, 3)
+
+    def test_full_sample_is_exact(self):
+        intervals = ["g1.1 z 1 2\n", "g2.1 z 1 18\n", "g2.1 y 100 120\n"]
+        stats = pedpha.sample_stats(self.lines, 10, intervals)
+        stats = {x[0]: x[1:] for x in stats}
+        self.assertEqual(stats['mapped'], (2/3, 2/3, 2/3))
+        self.assertEqual(stats['phase5_0'], (0.5, 0.5, 0.5))
+        self.assertEqual(stats['phase5_1'], (0.0, 0.0, 0.0))
+        self.assertEqual(stats['phase5_2'], (0.5, 0.5, 0.5))
+        self.assertEqual(stats['phase3_0'], (0.5, 0.5, 0.5))
+        self.assertEqual(stats['phase3_2'], (0.5, 0.5, 0.5))
+
+    def test_ratio_estimate(self):
+        self.assertEqual(sampling.ratio_estimate([(0, 0), (0, 0)], 10), None)
+        r, lo, hi = sampling.ratio_estimate([(1, 2), (3, 4), (0, 2), (2, 2)], 100)
+        self.assertEqual(r, 0.6)
+        self.assertTrue(0 <= lo < r < hi <= 1)
+
 class Test_to_dna_coor(unittest.TestCase):
     def test_equal(self):
         self.assertEqual(pedpha.to_dna_interval([1,1]), [1,3])